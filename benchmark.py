@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+__author__ = "Julien Mousqueton"
+__email__ = "julien.mousqueton_AT_computacenter.com"
+__version__ = "1.0.0"
+
+'''
+Benchmark du chemin analyse / rendu de boamp.py
+
+Journées de test synthétiques (MAPA, FNSimple, EFORMS 1 lot, EFORMS 50+ lots)
+ou enregistrées (snapshots de data/), webhooks remplacées par un stub local.
+Les résultats sont écrits en JSON pour comparer les versions entre elles.
+'''
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import boamp
+
+# Seuils de rendu (valeurs de .env.sample) pour des résultats comparables d'une machine à l'autre
+CONFIG = {
+    'montant1': '1000000.00',
+    'montant2': '2000000.00',
+    'montant3': '4000000.00',
+    'seuilmarches': '221k€',
+}
+
+# Define custom logging function
+def stdlog(msg):
+    '''Standard info logging'''
+    logging.info(msg)
+
+
+class StubResponse:
+    status_code = 200
+    text = 'ok'
+
+
+class StubSession:
+    '''
+    Remplace la session HTTP partagée : aucune requête ne quitte la machine
+    '''
+    def post(self, url, **kwargs):
+        return StubResponse()
+
+
+def eforms_extension(content):
+    return {'ext:UBLExtensions': {'ext:UBLExtension': {'ext:ExtensionContent': {'efext:EformsExtension': content}}}}
+
+
+def eforms_criterion(name, weight):
+    criterion = {'cbc:AwardingCriterionTypeCode': {'#text': name}}
+    criterion.update(eforms_extension({'efac:AwardCriterionParameter': {'efbc:ParameterNumeric': weight}}))
+    return criterion
+
+
+def eforms_contract_notice(nblots, total):
+    '''
+    Avis de marché EFORMS de nblots lots
+    '''
+    lots = []
+    for i in range(nblots):
+        lots.append({
+            'cbc:ID': {'#text': 'LOT-%04d' % (i + 1)},
+            'cac:TenderingTerms': {'cac:AwardingTerms': {'cac:AwardingCriterion': {
+                'cbc:Description': {'#text': 'Prix 60 %, valeur technique 40 %'},
+                'cac:SubordinateAwardingCriterion': [eforms_criterion('price', '60'), eforms_criterion('quality', '40')]}}},
+            'cac:ProcurementProject': {
+                'cbc:Name': {'#text': 'Lot %d : matériel et maintenance' % (i + 1)},
+                'cbc:Description': {'#text': 'Fourniture, installation et maintenance du lot %d' % (i + 1)},
+                'cac:PlannedPeriod': {'cbc:DurationMeasure': {'#text': '4', '@unitCode': 'YEAR'}},
+                'cac:RequestedTenderTotal': {'cbc:EstimatedOverallContractAmount': {'#text': str(150000 * (i + 1))}}},
+        })
+    organizations = [
+        {'efac:Company': {'cac:PartyName': {'cbc:Name': {'#text': 'Centre hospitalier de Rennes'}}}, 'efbc:AwardingCPBIndicator': 'true'},
+        {'efac:Company': {'cac:PartyName': {'cbc:Name': {'#text': 'Ministère des Armées'}}}},
+    ]
+    notice = eforms_extension({'efac:Organizations': {'efac:Organization': organizations}})
+    notice['cac:ProcurementProjectLot'] = lots[0] if nblots == 1 else lots
+    notice['cac:ProcurementProject'] = {'cac:RequestedTenderTotal': {'cbc:EstimatedOverallContractAmount': {'#text': total}}}
+    return {'EFORMS': {'ContractNotice': notice}}
+
+
+def eforms_award_notice(nblots, total):
+    '''
+    Avis d'attribution EFORMS de nblots lots
+    '''
+    results = [{'cbc:ID': {'#text': 'RES-%04d' % i},
+                'efac:ReceivedSubmissionsStatistics': [{'efbc:StatisticsCode': {'@listName': 'received-submission-type'}, 'efbc:StatisticsNumeric': 2 + i % 5}]}
+               for i in range(nblots)]
+    tenders = [{'cac:LegalMonetaryTotal': {'cbc:PayableAmount': {'#text': str(80000 * (i + 1))}}, 'efac:TenderReference': {'cbc:ID': 'TEN-%04d' % i}}
+               for i in range(nblots)]
+    contracts = [{'cbc:Title': {'#text': 'Lot n°%d Société %d' % (i + 1, i + 1)}} for i in range(nblots)]
+    single = nblots == 1
+    notice = eforms_extension({'efac:NoticeResult': {
+        'cbc:TotalAmount': {'#text': total},
+        'efac:LotResult': results[0] if single else results,
+        'efac:LotTender': tenders[0] if single else tenders,
+        'efac:SettledContract': contracts[0] if single else contracts}})
+    notice['cac:ProcurementProjectLot'] = {'cac:TenderingTerms': {'cac:AwardingTerms': {'cac:AwardingCriterion': {
+        'cac:SubordinateAwardingCriterion': [eforms_criterion('cost', '70'), eforms_criterion('quality', '30')]}}}}
+    return {'EFORMS': {'ContractAwardNotice': notice}}
+
+
+def mapa_notice(i):
+    if i % 2:
+        return 'ATTRIBUTION', 'MAPA', {'MAPA': {'attribution': {'avisInitial': {'idWeb': '24-%06d' % (i - 1)},
+                                                                  'attribution': {'resultat': {'attribue': {'montant': {'valeur': str(20000 + 1000 * i)}}}}}}}
+    return 'APPEL_OFFRE', 'MAPA', {'MAPA': {'initial': {'natureMarche': {'nbMois': '12'},
+                                                        'delais': {'receptionOffres': '2030-04-01T12:00:00'},
+                                                        'renseignements': {'idMarche': 'REF-%d' % i},
+                                                        'criteres': {'criterePondere': [{'critere': 'Prix', 'criterePCT': '60'},
+                                                                                         {'critere': 'Valeur technique', 'criterePCT': '40'}]}}}}
+
+
+def fnsimple_notice(i):
+    if i % 2:
+        return 'ATTRIBUTION', 'Marchés entre 90 k€ et seuils européens', {'FNSimple': {'attribution': {'avisInitial': {'idWeb': '24-%06d' % (i - 1)},
+                                                                                                       'attributionMarche': 'Société A\nSociété B'}}}
+    return 'APPEL_OFFRE', 'Marchés entre 90 k€ et seuils européens', {'FNSimple': {'initial': {
+        'procedure': {'dateReceptionOffres': '2030-05-02'},
+        'natureMarche': {'dureeMois': '24', 'valeurEstimee': {'fourchette': {'valeurHaute': str(100000 + 10000 * i)}}}}}}
+
+
+def eforms_notice(i):
+    if i % 2:
+        return 'ATTRIBUTION', 'Marchés européens', eforms_award_notice(1, str(300000 + 50000 * i))
+    return 'APPEL_OFFRE', 'Marchés européens', eforms_contract_notice(1, str(400000 + 250000 * i))
+
+
+def eforms_lots_notice(i):
+    if i % 2:
+        return 'ATTRIBUTION', 'Marchés européens', eforms_award_notice(55, str(5000000 + 100000 * i))
+    return 'APPEL_OFFRE', 'Marchés européens', eforms_contract_notice(60, str(5000000 + 100000 * i))
+
+
+SYNTHETIC_FIXTURES = {
+    'mapa': mapa_notice,
+    'fnsimple': fnsimple_notice,
+    'eforms': eforms_notice,
+    'eforms_lots': eforms_lots_notice,
+}
+
+SERVICES = [
+    ['Informatique (matériel)', 'Informatique (maintenance serveurs et réseaux)'],
+    ['Logiciel', 'Informatique (prestations de services)'],
+    ['Informatique (assistance)', 'Télécommunications'],
+    ['Imprimerie', 'Internet'],
+]
+
+
+def synthetic_day(name, count):
+    '''
+    Génère count enregistrements de l'API BOAMP pour la journée de test name
+    '''
+    records = []
+    for i in range(count):
+        nature, famille, donnees = SYNTHETIC_FIXTURES[name](i)
+        records.append({
+            'idweb': '24-%06d' % i,
+            'nature': nature,
+            'nomacheteur': 'Acheteur %d' % (i % 40),
+            'objet': 'Fourniture et maintenance informatique n°%d' % i,
+            'descripteur_code': ['162', '454'],
+            'descripteur_libelle': SERVICES[i % len(SERVICES)],
+            'dateparution': '2024-03-01',
+            'famille_libelle': famille,
+            'url_avis': 'https://www.boamp.fr/pages/avis/?q=idweb:24-%06d' % i,
+            'datelimitereponse': '2030-01-01T00:00:00+00:00',
+            'titulaire': ['Société A', 'Société B'] if nature == 'ATTRIBUTION' else None,
+            'donnees': json.dumps(donnees, ensure_ascii=False),
+        })
+    return records
+
+
+def recorded_days(paths):
+    '''
+    Charge les journées enregistrées (snapshots data/boamp-<date>.json[.gz|.zst])
+    '''
+    days = {}
+    for date, files in boamp.replay_groups(paths):
+        days[date] = list(boamp.iter_snapshot_records(files))
+    return days
+
+
+def setup_boamp(workers):
+    '''
+    Configuration globale de boamp.py telle que définie dans son __main__, webhooks locales
+    '''
+    settings = {
+        'debug_mode': False, 'force_mode': False, 'seen_index': None, 'seen_db': None, 'notice_db': None,
+        'USER_KEY': None, 'API_KEY': None, 'snapshot_compression': '', 'snapshot_niveau': 0,
+        'ms_webhook_marche': 'https://localhost/teams/marche', 'ms_webhook_attribution': 'https://localhost/teams/attribution',
+        'mattermost_webhook_marche': 'https://localhost/teams/marche', 'mattermost_webhook_attribution': 'https://localhost/teams/attribution',
+        'parse_workers': workers, 'parse_process_seuil': 0,
+        'livraison_workers': 4, 'livraison_concurrence': 2, 'livraison_debit': 0, 'livraison_essais': 1, 'livraison_backoff': 0, 'digest_mode': False,
+    }
+    settings.update(CONFIG)
+    for name, value in settings.items():
+        setattr(boamp, name, value)
+    boamp._http_session = StubSession()
+
+
+@contextlib.contextmanager
+def quiet():
+    '''
+    Masque les logs et les print de boamp.py pendant les mesures
+    '''
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        logger.setLevel(level)
+
+
+def latency_stats(latencies_ns, peak_bytes):
+    '''
+    Débit, percentiles de latence (µs) et pic mémoire (ko)
+    '''
+    quantiles = statistics.quantiles(latencies_ns, n=100, method='inclusive') if len(latencies_ns) > 1 else latencies_ns * 99
+    return {
+        'records_per_s': round(len(latencies_ns) / (sum(latencies_ns) / 1e9), 1) if sum(latencies_ns) else None,
+        'p50_us': round(quantiles[49] / 1000, 1),
+        'p90_us': round(quantiles[89] / 1000, 1),
+        'p99_us': round(quantiles[98] / 1000, 1),
+        'max_us': round(max(latencies_ns) / 1000, 1),
+        'peak_memory_kb': round(peak_bytes / 1024, 1),
+    }
+
+
+def measure(func, items, repeat):
+    '''
+    Mesure func sur chaque élément de items : latences sur repeat passes,
+    pic mémoire sur une passe séparée (tracemalloc fausse les temps)
+    '''
+    latencies = []
+    with quiet():
+        for _ in range(repeat):
+            for item in items:
+                start = time.perf_counter_ns()
+                func(item)
+                latencies.append(time.perf_counter_ns() - start)
+        tracemalloc.start()
+        for item in items:
+            func(item)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return latency_stats(latencies, peak)
+
+
+def measure_parse(records, repeat, directory):
+    '''
+    Mesure parse_boamp_data de bout en bout (snapshot sur disque, rendu, envoi vers le stub) pour une journée
+    '''
+    path = os.path.join(directory, 'boamp-bench.json')
+    with open(path, 'wb') as file:
+        file.write(boamp.json_dumps({'results': records, 'total_count': len(records)}))
+    snapshot = {'total_count': len(records), 'files': [path]}
+    durations = []
+    with quiet():
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            boamp.parse_boamp_data(snapshot, '2024-03-01')
+            durations.append(time.perf_counter_ns() - start)
+        tracemalloc.start()
+        boamp.parse_boamp_data(snapshot, '2024-03-01')
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    # Latence ramenée à un enregistrement pour comparer des journées de tailles différentes
+    stats = latency_stats([duration / len(records) for duration in durations], peak)
+    stats['day_s'] = round(statistics.median(durations) / 1e9, 4)
+    return stats
+
+
+def bench_day(name, records, repeat, directory):
+    '''
+    Mesure toutes les étapes pour une journée de test
+    '''
+    stdlog('Mesure de la journée ' + name + ' (' + str(len(records)) + ' enregistrements)')
+    config = boamp.render_config()
+    with quiet():
+        notices = [boamp.build_notice(record, config) for record in records]
+    return {
+        'records': len(records),
+        'parse_boamp_data': measure_parse(records, repeat, directory),
+        'build_notice': measure(lambda record: boamp.build_notice(record, config), records, repeat),
+        'notice_logos': measure(lambda notice: boamp.notice_logos(notice['nature'], notice['typemarche'], notice['montanttotal'], notice['services'], config),
+                                notices, repeat),
+        'markdown': measure(lambda notice: boamp.mattermost_payload(notice['title'], notice['message']), notices, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de l'analyse et du rendu des avis BOAMP")
+    parser.add_argument("-n", "--nombre", type=int, default=200, help="Nombre d'enregistrements par journée synthétique")
+    parser.add_argument("-r", "--repetitions", type=int, default=3, help="Nombre de passes mesurées")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="Processus d'analyse (PARSE_WORKERS)")
+    parser.add_argument("-f", "--fichiers", nargs='*', default=[], metavar="FICHIER", help="Journées enregistrées (data/boamp-<date>.json[.gz])")
+    parser.add_argument("-o", "--sortie", type=str, default=None, help="Fichier de résultats (par défaut benchmark-<version>.json)")
+    args = parser.parse_args()
+
+    setup_boamp(args.workers)
+
+    days = {name: synthetic_day(name, args.nombre) for name in SYNTHETIC_FIXTURES}
+    for date, records in recorded_days(args.fichiers).items():
+        if records:
+            days['enregistre-' + date] = records
+
+    results = {
+        'version': boamp.__version__,
+        'python': platform.python_version(),
+        'json': boamp.JSON_BACKEND,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'repetitions': args.repetitions,
+        'workers': args.workers,
+        'journees': {},
+    }
+    directory = tempfile.mkdtemp(prefix='boamp-bench-')
+    try:
+        for name, records in days.items():
+            results['journees'][name] = bench_day(name, records, args.repetitions, directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    amounts = [str(10 ** (i % 8) * (1 + i % 7)) for i in range(10000)]
+    results['format_large_number'] = measure(boamp.format_large_number, amounts, args.repetitions)
+
+    output = args.sortie or 'benchmark-' + boamp.__version__ + '.json'
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=4, ensure_ascii=False)
+    for name, day in results['journees'].items():
+        stdlog(f"{name:<24} parse {day['parse_boamp_data']['records_per_s']} avis/s, p99 {day['build_notice']['p99_us']} µs/avis")
+    stdlog('Résultats écrits dans ' + output)
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,19 @@ __version__ = "3.1.1"
 # Import for necessary Python modules
 import requests
 import json 
+
+# JSON : orjson ou msgspec si installés (plus rapides), sinon json (stdlib)
+try:
+    import orjson
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    try:
+        import msgspec
+        JSON_BACKEND = 'msgspec'
+    except ImportError:
+        JSON_BACKEND = 'json'
 import pymsteams # To Publish Card on teams 
-from datetime import datetime, timedelta 
+from datetime import datetime, timedelta, timezone
 import logging 
 import argparse
 import re # For removing HTML tag in debug mode 
@@ -23,13 +34,82 @@ import gzip
 # For checking python version
 import sys
 
-# For pushover notification
-import http.client, urllib
+# For pushover notification and webhook hosts
+import urllib.parse
 
 #For reading .env 
 import os 
 from dotenv import load_dotenv
 
+# Pagination et envoi des messages en parallèle, analyse multi-processus
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial, lru_cache
+import threading
+import time
+import contextlib
+import bisect
+import unicodedata
+import random
+from email.utils import parsedate_to_datetime
+
+# Index des avis déjà traités
+import sqlite3
+import hashlib
+
+# Snapshots écrits en flux
+import shutil
+import tempfile
+from itertools import islice
+
+# Lecture en flux des fichiers JSON (optionnel)
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Compression zstd des snapshots (optionnel)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# API BOAMP (explore v2.1)
+BOAMP_API_URL = "https://www.boamp.fr/api/explore/v2.1/catalog/datasets/boamp/records"
+KEYWORDS_API_URL = "https://www.boamp.fr/api/explore/v2.1/catalog/datasets/liste-mots-descripteurs-boamp%2F/records"
+KEYWORDS_PARAMS = {"order_by": "mc_libelle", "timezone": "UTC", "include_links": "false", "include_app_metas": "false"}
+KEYWORDS_CACHE_FILE = "data/motsclefs.json" # Cache du catalogue des mots clefs
+PAGE_SIZE = 100 # Nombre maximum d'enregistrements par page autorisé par l'API
+MAX_RECORDS = 10000 # L'API refuse offset + limit > 10000
+STREAM_CHUNK_SIZE = 65536 # Taille des blocs écrits sur disque lors du téléchargement
+SNAPSHOT_EXTENSIONS = {'': '.json', 'gzip': '.json.gz', 'zstd': '.json.zst'} # Extension par compression
+PARSE_BATCH_SIZE = 256 # Nombre d'enregistrements transmis à la fois au pool de processus
+
+# Transport HTTP partagé
+HTTP_TIMEOUT = (5, 30) # Timeout (connexion, lecture) en secondes
+HTTP_POOL_SIZE = 10 # Nombre de connexions gardées ouvertes par hôte
+PUSHOVER_API_URL = "https://api.pushover.net/1/messages.json"
+RETRY_STATUS = (429, 500, 502, 503, 504) # Réponses des webhooks donnant lieu à une nouvelle tentative
+RETRY_MAX_DELAY = 60 # Attente maximum entre deux tentatives en secondes
+
+SEEN_INDEX_FILE = "data/index.sqlite" # Index des avis déjà traités
+NOTICE_STORE_FILE = "data/avis.sqlite" # Base locale des avis pour l'historique
+MANIFEST_FILE = "data/manifest.sqlite" # Manifeste des snapshots pour le nettoyage
+DEAD_LETTER_FILE = "data/deadletter.jsonl" # Messages non envoyés, renvoyés à l'exécution suivante
+STATS_FILE = "statistiques.sqlite" # Statistiques journalières
+STATS_SCHEMA_VERSION = 1 # Version du schéma de la base des statistiques (PRAGMA user_version)
+
+# Statistiques par descripteur, acheteur et tranche de montant : {date: {(dimension, valeur): nombre}}
+stats_dimensions = {}
+
+# Listes de surveillance compilées (cf compile_watchlists), None si LISTES_SURVEILLANCE est vide
+watchlists = None
+
+# Règles de logos compilées (cf compile_logos), compilées à la demande à partir de MONTANT1/2/3 si None
+logo_classifier = None
+
+# Table de routage compilée (cf compile_routes), à défaut construite à partir des webhooks du .env
+routes = None
+
 # Init compteurs 
 cptao = 0  # compteur des avis de marché 
 cptmodif = 0 # compteur des modification 
@@ -57,63 +137,287 @@ def errlog(msg):
     '''Error logging'''
     logging.error(msg)
 
+def json_loads(data):
+    """
+    Décode un document JSON (str ou bytes) avec le backend le plus rapide disponible
+    """
+    if JSON_BACKEND == 'orjson':
+        return orjson.loads(data)
+    if JSON_BACKEND == 'msgspec':
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def json_dumps(obj):
+    """
+    Encode obj en JSON compact (bytes UTF-8) avec le backend le plus rapide disponible
+    """
+    if JSON_BACKEND == 'orjson':
+        return orjson.dumps(obj)
+    if JSON_BACKEND == 'msgspec':
+        return msgspec.json.encode(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
 # Remove HTML Code from message in debug mode  
 def remove_html_tags(text):
     clean = re.compile('<.*?>')
     return re.sub(clean, '', text)
 
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def http_session():
+    """
+    Retourne la session HTTP partagée par tous les appels sortants 
+    (pool de connexions keep-alive par hôte, réponses compressées gzip)
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({
+                'Accept-Encoding': 'gzip, deflate',
+                'User-Agent': 'boamp-alert/' + __version__
+            })
+            _http_session = session
+    return _http_session
+
+
+# Métriques du run : temps par étape et compteurs (requêtes, échecs, reprises, octets)
+_metrics_lock = threading.Lock()
+_metrics_start = time.time()
+metrics_stages = {} # {étape: [nombre d'appels, secondes]}
+metrics_counters = {} # {compteur: {cible: valeur}}
+
+def record_time(stage, seconds):
+    """
+    Ajoute une durée au temps passé dans l'étape stage
+    """
+    with _metrics_lock:
+        values = metrics_stages.setdefault(stage, [0, 0.0])
+        values[0] += 1
+        values[1] += seconds
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    Mesure le temps passé dans un bloc : with timed('recuperation_api'): ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(stage, time.perf_counter() - start)
+
+
+def count(name, target, value=1):
+    """
+    Incrémente le compteur name (requetes, echecs, reprises, octets_recus, ...) pour la cible target (api, msteams, ...)
+    """
+    with _metrics_lock:
+        targets = metrics_counters.setdefault(name, {})
+        targets[target] = targets.get(target, 0) + value
+
+
+def prom_label(value):
+    """
+    Valeur d'étiquette au format texte Prometheus (\\, " et retour à la ligne échappés)
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_metrics(path):
+    """
+    Exporte les métriques du run : fichier texte Prometheus (extension .prom, collecteur textfile 
+    de node_exporter) ou rapport JSON
+    input :
+        path : fichier de destination
+    """
+    with _metrics_lock:
+        stages = {stage: list(values) for stage, values in metrics_stages.items()}
+        counters = {name: dict(targets) for name, targets in metrics_counters.items()}
+    notices = day_counters()
+    if path.endswith('.prom'):
+        lines = ['# HELP boamp_stage_seconds_total Temps passé par étape',
+                 '# TYPE boamp_stage_seconds_total counter']
+        lines += [f'boamp_stage_seconds_total{{stage="{prom_label(stage)}"}} {seconds:.6f}' for stage, (calls, seconds) in sorted(stages.items())]
+        lines += ['# HELP boamp_stage_calls_total Nombre de passages par étape',
+                  '# TYPE boamp_stage_calls_total counter']
+        lines += [f'boamp_stage_calls_total{{stage="{prom_label(stage)}"}} {calls}' for stage, (calls, seconds) in sorted(stages.items())]
+        for name, targets in sorted(counters.items()):
+            lines.append(f'# TYPE boamp_{name}_total counter')
+            lines += [f'boamp_{name}_total{{cible="{prom_label(target)}"}} {value}' for target, value in sorted(targets.items())]
+        lines.append('# TYPE boamp_avis_total counter')
+        lines += [f'boamp_avis_total{{nature="{prom_label(nature)}"}} {value}' for nature, value in notices.items()]
+        lines.append('# TYPE boamp_run_start_timestamp_seconds gauge')
+        lines.append(f'boamp_run_start_timestamp_seconds {_metrics_start:.0f}')
+        lines.append('# TYPE boamp_run_duration_seconds gauge')
+        lines.append(f'boamp_run_duration_seconds {time.time() - _metrics_start:.3f}')
+        content = ('\n'.join(lines) + '\n').encode('utf-8')
+    else:
+        content = json_dumps({
+            'debut': datetime.fromtimestamp(_metrics_start).isoformat(timespec='seconds'),
+            'duree': round(time.time() - _metrics_start, 3),
+            'etapes': {stage: {'appels': calls, 'secondes': round(seconds, 6)} for stage, (calls, seconds) in sorted(stages.items())},
+            'compteurs': counters,
+            'avis': notices,
+        })
+    # Ecriture atomique : le collecteur ne lit jamais un fichier partiel
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def log_metrics():
+    """
+    Affiche le temps passé par étape
+    """
+    with _metrics_lock:
+        stages = sorted(metrics_stages.items(), key=lambda item: -item[1][1])
+    for stage, (calls, seconds) in stages:
+        stdlog('⏱️ ' + stage + ' : ' + f"{seconds:.3f}" + 's (' + str(calls) + ' appel(s))')
+
+
+_manifest_db = None
+_manifest_lock = threading.Lock()
+
+def manifest_db():
+    """
+    Connexion au manifeste des snapshots (fichier, date, état : raw, compressed ou expired), 
+    initialisé par un unique parcours du répertoire data à sa création.
+    A appeler en détenant _manifest_lock.
+    """
+    global _manifest_db
+    if _manifest_db is None:
+        conn = sqlite3.connect(MANIFEST_FILE, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS snapshots (path TEXT PRIMARY KEY, date TEXT NOT NULL, state TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS snapshots_state_date ON snapshots (state, date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS snapshots_date ON snapshots (date)")
+        if conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0] == 0:
+            pattern = re.compile(r'(\d{4}-\d{2}-\d{2})')
+            entries = []
+            for filename in os.listdir('data'):
+                file_path = os.path.join('data', filename)
+                matches = pattern.findall(filename)
+                if matches and filename.endswith(('.json', '.gz', '.zst')) and os.path.isfile(file_path):
+                    entries.append((file_path, matches[0], 'compressed' if compression_of(filename) else 'raw'))
+            conn.executemany("INSERT OR REPLACE INTO snapshots (path, date, state) VALUES (?, ?, ?)", entries)
+            dbglog(str(len(entries)) + ' fichier(s) ajouté(s) au manifeste ' + MANIFEST_FILE)
+        conn.commit()
+        _manifest_db = conn
+    return _manifest_db
+
+
+def register_snapshot(path, date):
+    """
+    Ajoute un fichier de snapshot au manifeste
+    input :
+        path : fichier (.json, .json.gz ou .json.zst)
+        date : date de parution au format yyyy-mm-dd
+    """
+    with _manifest_lock:
+        conn = manifest_db()
+        conn.execute("INSERT OR REPLACE INTO snapshots (path, date, state) VALUES (?, ?, ?)",
+                     (path, date, 'compressed' if compression_of(path) else 'raw'))
+        conn.commit()
+
+
 def housekeeping(day_before_gzip, day_before_delete):
     """
-    Nettoye le répertoire directory_path
+    Compresse puis efface les snapshots du répertoire data d'après le manifeste : 
+    seuls les fichiers ayant franchi un seuil depuis le dernier passage sont lus
     input : 
         day_before_gzip 
         day_before_delete 
     """
-    directory_path = "./data"
     # Get the current date
     current_date = datetime.now()
 
-    # Calculate the threshold dates
-    threshold_gzip_date = current_date - timedelta(days=day_before_gzip)
-    dbglog('Date avant compression : ' + str(threshold_gzip_date))
-    threshold_delete_date = current_date - timedelta(days=day_before_delete)
-    dbglog('Date avant effacement : ' + str(threshold_delete_date))
-    pattern = re.compile(r'(\d{4}-\d{2}-\d{2})')
-    file_date_format = '%Y-%m-%d'
-    # Iterate through files in the directory
-    for filename in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, filename)
-
-        # Check if it's a file
-        if os.path.isfile(file_path):
-            # Extract date from the filename
-            matches = pattern.findall(filename)
-
-            if matches:
-                file_date_str = matches[0]
-            else:
-                # stdlog("Ignored file with unexpected date format: " + filename)
-                continue
-            
-            # Convert date string to datetime
-            file_date = datetime.strptime(file_date_str, file_date_format)
-
-            # Gzip the file if it's older than the threshold date for gzip
-            if day_before_gzip > 0 and file_date < threshold_gzip_date and filename.endswith('.json'):
-                gzip_filename = f"{filename}.gz"
-                gzip_filepath = os.path.join(directory_path, gzip_filename)
-
-                with open(file_path, 'rb') as f_in, gzip.open(gzip_filepath, 'wb') as f_out:
-                    f_out.writelines(f_in)
-
+    # Calculate the threshold dates (un fichier du jour seuil est antérieur à l'heure seuil)
+    threshold_gzip_date = (current_date - timedelta(days=day_before_gzip)).strftime('%Y-%m-%d')
+    dbglog('Date avant compression : ' + threshold_gzip_date)
+    threshold_delete_date = (current_date - timedelta(days=day_before_delete)).strftime('%Y-%m-%d')
+    dbglog('Date avant effacement : ' + threshold_delete_date)
+
+    with _manifest_lock:
+        conn = manifest_db()
+        to_delete = []
+        if day_before_delete > 0:
+            to_delete = conn.execute("SELECT path FROM snapshots WHERE state IN ('raw', 'compressed') AND date <= ? ORDER BY date", 
+                                     (threshold_delete_date,)).fetchall()
+        to_gzip = []
+        if day_before_gzip > 0:
+            to_gzip = conn.execute("SELECT path, date FROM snapshots WHERE state = 'raw' AND date <= ? AND date > ? ORDER BY date", 
+                                   (threshold_gzip_date, threshold_delete_date if day_before_delete > 0 else '')).fetchall()
+
+    # Un fichier à la fois, le verrou laisse passer les écritures de snapshots entre deux fichiers
+    for (file_path,) in to_delete:
+        with _manifest_lock:
+            if conn.execute("SELECT 1 FROM snapshots WHERE path = ? AND state != 'expired'", (file_path,)).fetchone():
+                try:
+                    os.remove(file_path)
+                    stdlog("Effacement de : " + os.path.basename(file_path))
+                except FileNotFoundError:
+                    pass
+                conn.execute("UPDATE snapshots SET state = 'expired' WHERE path = ?", (file_path,))
+                conn.commit()
+
+    # Gzip the files older than the threshold date for gzip
+    # (uniquement les fichiers écrits sans compression, cf SNAPSHOT_COMPRESSION)
+    # La compression se fait hors du verrou dans un fichier temporaire : le verrou n'est pris que pour le renommage 
+    # et le manifeste, le fichier étant ignoré s'il a été réécrit ou retiré entre temps
+    for file_path, file_date in to_gzip:
+        gzip_filepath = file_path + '.gz'
+        tmp_path = gzip_filepath + '.tmp'
+        try:
+            before = os.stat(file_path)
+            with open(file_path, 'rb') as f_in, open_snapshot(tmp_path, 'wb', 'gzip') as f_out:
+                shutil.copyfileobj(f_in, f_out, STREAM_CHUNK_SIZE)
+        except FileNotFoundError:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            with _manifest_lock:
+                if not os.path.exists(file_path):
+                    conn.execute("DELETE FROM snapshots WHERE path = ? AND state = 'raw'", (file_path,))
+                    conn.commit()
+            continue
+        with _manifest_lock:
+            try:
+                after = os.stat(file_path)
+            except FileNotFoundError:
+                after = None
+            if after and (after.st_mtime_ns, after.st_size) == (before.st_mtime_ns, before.st_size) and \
+                    conn.execute("SELECT 1 FROM snapshots WHERE path = ? AND state = 'raw'", (file_path,)).fetchone():
+                os.replace(tmp_path, gzip_filepath)
                 # Remove the original .json file
                 os.remove(file_path)
-                stdlog("Compression de " + filename)
+                conn.execute("DELETE FROM snapshots WHERE path = ?", (file_path,))
+                conn.execute("INSERT OR REPLACE INTO snapshots (path, date, state) VALUES (?, ?, 'compressed')", (gzip_filepath, file_date))
+                conn.commit()
+                stdlog("Compression de " + os.path.basename(file_path))
+            else:
+                os.remove(tmp_path)
+                dbglog(os.path.basename(file_path) + ' modifié pendant la compression, reporté au prochain nettoyage')
 
-            # Delete the file if it's a gzip or json file and older than the threshold date for deletion
-            elif day_before_delete > 0 and (filename.endswith('.gz') or filename.endswith('.json')) and file_date < threshold_delete_date:
-                os.remove(file_path)
-                stdlog ("Effacement de : " + filename)
+
+def start_housekeeping(day_before_gzip, day_before_delete):
+    """
+    Lance housekeeping dans un thread pour ne pas retarder la récupération et l'envoi des avis
+    output :
+        thread (à attendre avec join avant la fin du programme)
+    """
+    def run():
+        with timed('nettoyage'):
+            housekeeping(day_before_gzip, day_before_delete)
+    thread = threading.Thread(target=run, name='housekeeping')
+    thread.start()
+    return thread
 
 
 def format_large_number(number_str):
@@ -140,59 +444,268 @@ def toPushover(message):
     """
     if USER_KEY and API_KEY and message:
         stdlog('Envoi d\'une notification PushOver')
-        #load_dotenv()
-        #USER_KEY=os.getenv('PUSH_USER')
-        #API_KEY= os.getenv('PUSH_API')
-        conn = http.client.HTTPSConnection("api.pushover.net:443")
-        conn.request("POST", "/1/messages.json",
-        urllib.parse.urlencode({
-                "token": API_KEY,
-                "user": USER_KEY,
-                "message": message,
-                "html": 1
-                }), { "Content-type": "application/x-www-form-urlencoded" })
-        conn.getresponse()
-    #else:
-    #    stdlog('Erreur d\'envoi de la notification PushOver')
-
-
-def fetch_boamp_data(date, select_option=None):
-    """
-    Fetches data from the BOAMP API for a given date.
-    :param date: A string representing the date in the format 'yyyy-MM-dd'.
-    :param attribution_only: A boolean indicating whether to filter for attribution announcements only.
-    :return: JSON response data.
+        try:
+            http_session().post(PUSHOVER_API_URL, data={
+                    "token": API_KEY,
+                    "user": USER_KEY,
+                    "message": message,
+                    "html": 1
+                    }, timeout=HTTP_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            errlog("Erreur d'envoi de la notification PushOver : " + str(e))
+
+
+def snapshot_path(date, page=1):
     """
-    year, month, day = date.split('-')
-    search = "date_format(dateparution, 'yyyy') = '" + year + "' and date_format(dateparution, 'MM') = '"+month+"' and date_format(dateparution, 'dd') = '"+day+"' and ("
-    query = ' OR '.join([f'dc = "{code}"' for code in descripteurs_list])
-    search += query + ")"
+    Chemin du fichier de la page page du snapshot du jour date (extension selon SNAPSHOT_COMPRESSION)
+    """
+    extension = SNAPSHOT_EXTENSIONS[snapshot_compression]
+    if page == 1:
+        return f"data/boamp-{date}{extension}"
+    return f"data/boamp-{date}-p{page}{extension}"
+
+
+def compression_of(path):
+    """
+    Compression d'un fichier d'après son extension : 'gzip', 'zstd' ou ''
+    """
+    if path.endswith('.gz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return ''
+
+
+def open_snapshot(path, mode='rb', compression=None):
+    """
+    Ouvre un fichier .json, .json.gz ou .json.zst en lecture ou en écriture (mode binaire)
+    input :
+        path : fichier
+        mode : 'rb' ou 'wb'
+        compression : 'gzip', 'zstd' ou '' (par défaut d'après l'extension de path)
+    """
+    if compression is None:
+        compression = compression_of(path)
+    if compression == 'gzip':
+        if 'w' in mode:
+            return gzip.open(path, mode, compresslevel=snapshot_niveau or 6)
+        return gzip.open(path, mode)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Le module zstandard est nécessaire pour les fichiers .zst (pip3 install zstandard)")
+        if 'w' in mode:
+            return zstandard.open(path, mode, cctx=zstandard.ZstdCompressor(level=snapshot_niveau or 3))
+        return zstandard.open(path, mode)
+    return open(path, mode)
+
+
+def remove_snapshot(date):
+    """
+    Supprime les fichiers d'un précédent snapshot du jour date (pages, versions compressées)
+    """
+    with _manifest_lock:
+        conn = manifest_db()
+        for (path,) in conn.execute("SELECT path FROM snapshots WHERE date = ? AND state != 'expired'", (date,)).fetchall():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        conn.execute("DELETE FROM snapshots WHERE date = ?", (date,))
+        conn.commit()
+
+
+def replace_snapshot(date, files):
+    """
+    Remplace le snapshot du jour date par les pages récupérées dans un répertoire temporaire : 
+    l'ancien snapshot n'est supprimé qu'une fois toutes les pages récupérées, sous un seul verrou du manifeste
+    input :
+        date : date du snapshot
+        files : pages dans l'ordre (répertoire temporaire), vide si le jour n'a plus d'avis
+    output :
+        fichiers du snapshot dans data/
+    """
+    paths = [snapshot_path(date, page) for page in range(1, len(files) + 1)]
+    with _manifest_lock:
+        conn = manifest_db()
+        for (path,) in conn.execute("SELECT path FROM snapshots WHERE date = ? AND state != 'expired'", (date,)).fetchall():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        conn.execute("DELETE FROM snapshots WHERE date = ?", (date,))
+        for source, path in zip(files, paths):
+            os.replace(source, path)
+        conn.executemany("INSERT OR REPLACE INTO snapshots (path, date, state) VALUES (?, ?, ?)",
+                         [(path, date, 'compressed' if compression_of(path) else 'raw') for path in paths])
+        conn.commit()
+    return paths
+
+
+def iter_snapshot_records(files):
+    """
+    Itère les avis d'un snapshot sans charger les fichiers en mémoire 
+    (avis par avis avec ijson, sinon page par page)
+    input :
+        files : fichiers du snapshot (.json, .json.gz ou .json.zst)
+    """
+    for path in files:
+        with open_snapshot(path) as file:
+            if ijson:
+                yield from ijson.items(file, 'results.item', use_float=True)
+            else:
+                yield from json_loads(file.read()).get('results', [])
+
+
+def snapshot_total_count(path):
+    """
+    Lit total_count dans une page de résultats de l'API
+    """
+    with open_snapshot(path) as file:
+        if ijson:
+            return next(ijson.items(file, 'total_count'), 0)
+        return json_loads(file.read()).get('total_count', 0)
+
+
+def last_idweb(files):
+    """
+    idweb du dernier avis d'un snapshot (ordre "dateparution, idweb" de l'API), seule la dernière page est lue
+    """
+    idweb = None
+    for record in iter_snapshot_records(files[-1:]):
+        idweb = record.get('idweb') or idweb
+    return idweb
+
+
+def download_page(params, offset, path):
+    """
+    Télécharge une page de résultats de l'API BOAMP directement dans un fichier, sans la décoder
+    input :
+        params : paramètres de la requête (select, where, ...)
+        offset : position du premier enregistrement de la page
+        path : fichier de destination
+    output :
+        path
+    """
+    page_params = dict(params, limit=PAGE_SIZE, offset=offset)
+    dbglog('Récupération de la page offset=' + str(offset) + ' dans ' + path)
+    tmp_path = path + '.tmp'
+    count('requetes', 'api')
+    try:
+        with timed('recuperation_api'):
+            try:
+                with http_session().get(BOAMP_API_URL, params=page_params, timeout=HTTP_TIMEOUT, stream=True) as response:
+                    response.raise_for_status()
+                    received = 0
+                    with open_snapshot(tmp_path, 'wb', compression_of(path)) as file:
+                        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                            file.write(chunk)
+                            received += len(chunk)
+            except requests.exceptions.RequestException:
+                count('echecs', 'api')
+                raise
+        count('octets_recus', 'api', received)
+        os.replace(tmp_path, path)
+    finally:
+        # Page partielle en cas d'erreur : le fichier temporaire ne reste pas dans data/
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+    return path
+
+
+def next_day(date):
+    """
+    Retourne le lendemain de date (format yyyy-mm-dd)
+    """
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def build_where(date_start, date_end, select_option=None, after_idweb=None):
+    """
+    Construit la clause where de l'API pour les avis publiés dans l'intervalle [date_start, date_end[
+    input :
+        date_start, date_end : dates au format yyyy-mm-dd
+        select_option : 'attribution', 'ao' ou 'rectificatif'
+        after_idweb : ne retient que les avis suivant cet idweb dans l'ordre de l'API (mode démon)
+    output :
+        clause where (ODSQL)
+    """
+    search = "dateparution >= date'" + date_start + "' and dateparution < date'" + date_end + "'"
+    if after_idweb:
+        search += ' and idweb > "' + after_idweb + '"'
+    # Les mots des listes de surveillance imposent une récupération large, filtrée localement (cf match_record)
+    if not (watchlists and watchlists['regex']):
+        codes = list(dict.fromkeys(descripteurs_list + (list(watchlists['codes']) if watchlists else [])))
+        search += " and (" + ' OR '.join([f'dc = "{code}"' for code in codes]) + ")"
     if select_option == 'attribution':
         search += " and nature='ATTRIBUTION'"
-        stdlog('(!) Seulement les attributions')
     elif select_option == 'ao':
         search += " and nature='APPEL_OFFRE'"
-        stdlog("(!) Seulement les Appels d'Offre")
     elif select_option == 'rectificatif':
         search += " and nature='RECTIFICATIF'"
-        stdlog("(!) Seulement les rectificatifs d'appels d'offre")
+    return search
+
+
+def fetch_boamp_data(date, select_option=None, parallel=False, date_end=None, directory=None, after_idweb=None):
+    """
+    Fetches data from the BOAMP API for a given date or date interval.
+    Each page is streamed as received to its own file.
+    :param date: A string representing the date in the format 'yyyy-MM-dd'.
+    :param select_option: 'attribution', 'ao' or 'rectificatif' to filter on the nature of the notice.
+    :param parallel: A boolean to fetch the remaining pages concurrently once total_count is known.
+    :param date_end: Exclusive end of the interval ('yyyy-MM-dd'), defaults to the day after date.
+    :param directory: Directory for the page files, defaults to the daily snapshot data/boamp-<date>.json
+                      (pages spooled to a temporary directory, the previous snapshot is only replaced once all pages are fetched).
+    :param after_idweb: Only fetch the notices following this idweb in the API order (see build_where).
+    :return: Snapshot {'total_count': ..., 'files': [...]}.
+    """
+    if not date_end:
+        date_end = next_day(date)
+    search = build_where(date, date_end, select_option, after_idweb)
     
-    url = "https://www.boamp.fr/api/explore/v2.1/catalog/datasets/boamp/records"
     params = {
         "select": "*",
         "where": f"{search}",
-        "limit": 99,
-        "offset": 0,
+        # Un ordre stable est nécessaire pour que les pages ne se chevauchent pas
+        "order_by": "dateparution, idweb",
         "timezone": "UTC",
         "include_links": "false",
         "include_app_metas": "false"
     }
+    spool = None
+    if directory:
+        page_path = lambda page: os.path.join(directory, f"page-{page}.json")
+    else:
+        spool = tempfile.mkdtemp(prefix='spool-', dir='data')
+        page_path = lambda page: os.path.join(spool, os.path.basename(snapshot_path(date, page)))
     if debug_mode:
-        stdlog('API : '+ url+'?select=*&where='+search)
+        stdlog('API : '+ BOAMP_API_URL +'?select=*&where='+search)
     try:
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        files = [download_page(params, 0, page_path(1))]
+        total_count = snapshot_total_count(files[0])
+        if total_count == 0:
+            os.remove(files[0])
+            if spool:
+                replace_snapshot(date, [])
+            return {'total_count': 0, 'files': []}
+
+        if total_count > MAX_RECORDS:
+            errmsg = "Plus de " + str(MAX_RECORDS) + " résultats, seuls les " + str(MAX_RECORDS) + " premiers sont récupérés"
+            stdlog(errmsg)
+            toPushover(errmsg)
+        pages = [(offset, page_path(offset // PAGE_SIZE + 1)) for offset in range(PAGE_SIZE, min(total_count, MAX_RECORDS), PAGE_SIZE)]
+        if pages:
+            stdlog(str(len(pages) + 1) + ' pages à récupérer pour ' + str(total_count) + ' enregistrement(s)')
+
+        if parallel and len(pages) > 1:
+            # Le premier appel donne total_count : les pages suivantes sont récupérées en parallèle
+            with ThreadPoolExecutor(max_workers=pagination_workers) as executor:
+                files.extend(executor.map(lambda page: download_page(params, *page), pages))
+        else:
+            for offset, path in pages:
+                files.append(download_page(params, offset, path))
+
+        if spool:
+            files = replace_snapshot(date, files)
+            stdlog('Ecriture du fichier ' + files[0] + ('' if len(files) == 1 else ' (' + str(len(files)) + ' pages)'))
+        return {'total_count': total_count, 'files': files}
 
     except requests.exceptions.HTTPError as errh:
         errmsg = "HTTP Error: " + str(errh)
@@ -210,12 +723,219 @@ def fetch_boamp_data(date, select_option=None):
         errmsg = "Other Error: " + str(err)
         stdlog(errmsg)
         toPushover(errmsg)
+    finally:
+        if spool:
+            shutil.rmtree(spool, ignore_errors=True)
+
+def split_snapshot(snapshot):
+    """
+    Répartit localement par date de parution les avis d'un snapshot multi-jours
+    et écrit au fil de l'eau un snapshot par jour (data/boamp-<date>.json, puis -p2, -p3, ... par PAGE_SIZE avis, 
+    comme les pages de l'API). La première page reste ouverte jusqu'à la fin pour y écrire le total du jour.
+    input :
+        snapshot : snapshot retourné par fetch_boamp_data
+    output :
+        dictionnaire {date: snapshot du jour}
+    """
+    days = {}
+    first_pages = {}
+    writers = {}
+
+    def close_page(writer, total):
+        writer.write(b'],"total_count":' + str(total).encode() + b'}')
+        writer.close()
+
+    try:
+        for record in iter_snapshot_records(snapshot['files']):
+            day = (record.get('dateparution') or '')[:10]
+            if day not in days:
+                remove_snapshot(day)
+                days[day] = {'total_count': 0, 'files': []}
+            position = days[day]['total_count'] % PAGE_SIZE
+            if position == 0:
+                path = snapshot_path(day, len(days[day]['files']) + 1)
+                if day in writers and writers[day] is not first_pages[day]:
+                    close_page(writers[day], PAGE_SIZE)
+                writers[day] = open_snapshot(path, 'wb')
+                writers[day].write(b'{"results":[')
+                first_pages.setdefault(day, writers[day])
+                days[day]['files'].append(path)
+            else:
+                writers[day].write(b',')
+            writers[day].write(json_dumps(record))
+            days[day]['total_count'] += 1
+    finally:
+        for day, writer in writers.items():
+            if writer is not first_pages[day]:
+                close_page(writer, days[day]['total_count'] % PAGE_SIZE or PAGE_SIZE)
+        for day, writer in first_pages.items():
+            close_page(writer, days[day]['total_count'])
+    for day in sorted(days):
+        for path in days[day]['files']:
+            register_snapshot(path, day)
+        files = days[day]['files']
+        stdlog('Ecriture du fichier ' + files[0] + ('' if len(files) == 1 else ' (' + str(len(files)) + ' pages)'))
+    return days
+
+
+def fetch_boamp_days(dates, select_option=None, parallel=False):
+    """
+    Récupère plusieurs jours en requêtes d'intervalle (une par fenêtre de BACKFILL_FENETRE jours)
+    puis répartit les avis localement par jour
+    input :
+        dates : liste ordonnée et continue de dates au format yyyy-mm-dd
+        select_option : 'attribution', 'ao' ou 'rectificatif'
+        parallel : récupère les pages en parallèle
+    output :
+        dictionnaire {date: snapshot du jour, None en cas d'erreur}
+    """
+    windows = [dates[i:i + backfill_fenetre] for i in range(0, len(dates), backfill_fenetre)]
+
+    def fetch_window(window):
+        spool = tempfile.mkdtemp(prefix='spool-', dir='data')
+        try:
+            data = fetch_boamp_data(window[0], select_option, parallel, next_day(window[-1]), spool)
+            return window, split_snapshot(data) if data else None
+        finally:
+            shutil.rmtree(spool, ignore_errors=True)
+
+    datas = {}
+    with ThreadPoolExecutor(max_workers=backfill_workers) as executor:
+        for window, days in executor.map(fetch_window, windows):
+            for date in window:
+                if days is None:
+                    datas[date] = None
+                else:
+                    datas[date] = days.get(date, {'total_count': 0, 'files': []})
+    return datas
+
+
+def open_seen_index(path=SEEN_INDEX_FILE):
+    """
+    Ouvre l'index des avis déjà traités et le charge en mémoire
+    input :
+        path : fichier SQLite de l'index
+    output :
+        connexion SQLite, dictionnaire {idweb: empreinte du contenu}
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS seen (idweb TEXT PRIMARY KEY, hash TEXT NOT NULL, dateparution TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+    index = dict(conn.execute("SELECT idweb, hash FROM seen"))
+    dbglog(str(len(index)) + ' avis dans l\'index ' + path)
+    return conn, index
+
+
+def notice_hash(record):
+    """
+    Empreinte du contenu d'un avis calculée sur les champs bruts (sans décoder les données)
+    """
+    content = '\x1f'.join(str(record.get(key, '')) for key in ('nature', 'objet', 'donnees'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def mark_seen(conn, index, entries):
+    """
+    Enregistre les avis traités dans l'index
+    input :
+        conn : connexion SQLite de l'index
+        index : dictionnaire en mémoire {idweb: empreinte}
+        entries : liste de tuples (idweb, empreinte, dateparution)
+    """
+    conn.executemany("INSERT OR REPLACE INTO seen (idweb, hash, dateparution) VALUES (?, ?, ?)", entries)
+    conn.commit()
+    for idweb, digest, dateparution in entries:
+        index[idweb] = digest
+
+
+def read_state(conn, key, default=None):
+    """
+    Lit une valeur persistante (ex : high-water mark du mode démon) dans l'index
+    """
+    if conn is None:
+        return default
+    row = conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def write_state(conn, key, value):
+    """
+    Enregistre une valeur persistante dans l'index
+    """
+    if conn is None:
+        return
+    conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+    conn.commit()
+
+
+def open_notice_store(path=NOTICE_STORE_FILE):
+    """
+    Ouvre la base locale des avis (une ligne normalisée par avis, descripteurs dans une table dédiée)
+    input :
+        path : fichier SQLite de la base
+    output :
+        connexion SQLite
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS notices (
+        idweb TEXT PRIMARY KEY, nature TEXT, dateparution TEXT, acheteur TEXT, objet TEXT, typemarche TEXT,
+        montanttotal REAL, montant REAL, date_reception_offres TEXT, nblots INTEGER, titulaire TEXT,
+        avisinitial TEXT, url TEXT)""")
+    conn.execute("CREATE TABLE IF NOT EXISTS notice_descripteurs (idweb TEXT NOT NULL, code TEXT NOT NULL, libelle TEXT, PRIMARY KEY (idweb, code))")
+    conn.execute("CREATE INDEX IF NOT EXISTS notices_dateparution ON notices (dateparution)")
+    conn.execute("CREATE INDEX IF NOT EXISTS notices_acheteur ON notices (acheteur)")
+    conn.execute("CREATE INDEX IF NOT EXISTS notices_nature ON notices (nature, dateparution)")
+    conn.execute("CREATE INDEX IF NOT EXISTS notice_descripteurs_code ON notice_descripteurs (code)")
+    return conn
+
+
+def to_float(value):
+    """
+    Convertit un montant en float, None si absent ou invalide
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def store_notices(conn, notices):
+    """
+    Enregistre (ou met à jour) les avis analysés dans la base locale
+    input :
+        conn : connexion SQLite de la base des avis
+        notices : liste des avis structurés (cf build_notice)
+    """
+    rows = []
+    descripteurs = []
+    for notice in notices:
+        deadline = notice['date_reception_offres']
+        rows.append((notice['idweb'], notice['nature'], notice['pubdate'], notice['acheteur'], notice['objet'],
+                     notice['typemarche'], to_float(notice['montanttotal']), to_float(notice['montant']),
+                     deadline if re.fullmatch(r'\d{4}-\d{2}-\d{2}', deadline or '') else None,
+                     notice['nblots'], notice['titulaire'] or None, notice['avisinitial'] or None, notice['url']))
+        descripteurs.extend((notice['idweb'], code, libelle) for code, libelle in notice['descripteurs'])
+    conn.executemany("INSERT OR REPLACE INTO notices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executemany("DELETE FROM notice_descripteurs WHERE idweb = ?", [(row[0],) for row in rows])
+    conn.executemany("INSERT OR REPLACE INTO notice_descripteurs (idweb, code, libelle) VALUES (?, ?, ?)", descripteurs)
+    conn.commit()
+    dbglog(str(len(rows)) + ' avis enregistré(s) dans la base ' + NOTICE_STORE_FILE)
+
+
+# Logo par nature d'avis
+STATUS_LOGOS = {
+    "APPEL_OFFRE": "🟢",
+    "RECTIFICATIF": "🟠",
+    "R\u00e9sultat de march\u00e9": "🏆",   # Vérifier la pertinence 
+    "ATTRIBUTION": "🏆",
+    "ANNULATION": "🛑",
+}
+
 
 def determine_status(nature):
     """
-    Determines the status based on the nature field.
+    Determines the status based on the nature field and updates the counters.
     :param nature: The nature field from the record.
-    :param record: The entire record from the response.
     :return: The determined status.
     """
     global cptao
@@ -225,732 +945,2194 @@ def determine_status(nature):
     global cptcancel
     match nature:
         case "APPEL_OFFRE":
-            status = "🟢"
             cptao += 1 
         case "RECTIFICATIF":
-            status = "🟠"
             cptmodif += 1
         case "R\u00e9sultat de march\u00e9":   # Vérifier la pertinence 
-            status = "🏆"
             cptres += 1
         case "ATTRIBUTION":
-            status = "🏆"
             cptres += 1
         case "ANNULATION":
-            status = "🛑"
             cptcancel += 1
         case _:
-            status = ""
             print('---> ',nature)
             cptother += 1
-    return status
+    return STATUS_LOGOS.get(nature, "")
 
 
-# Send message to Teams Channel regarding the nature of the message 
-def tomsteeams(nature,title,message):
+def teams_webhook(nature):
+    """
+    Retourne la webhook msteams correspondant à la nature de l'avis
+    """
     if nature == "ATTRIBUTION":
-        webhook = mattermost_webhook_attribution
-    else:
-        webhook = mattermost_webhook_marche
+        return ms_webhook_attribution
+    return ms_webhook_marche
+
+
+def mattermost_webhook(nature):
+    """
+    Retourne la webhook mattermost correspondant à la nature de l'avis
+    """
+    if nature == "ATTRIBUTION":
+        return mattermost_webhook_attribution
+    return mattermost_webhook_marche
+
+
+def retry_delay(retry_after, attempt):
+    """
+    Attente avant une nouvelle tentative : en-tête Retry-After (secondes ou date HTTP) s'il est présent,
+    sinon backoff exponentiel avec jitter (entre 0 et LIVRAISON_BACKOFF * 2^(tentative-1) secondes)
+    """
+    if retry_after:
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                seconds = None
+        if seconds is not None:
+            return min(max(seconds, 0), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, livraison_backoff * 2 ** (attempt - 1)))
+
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+def host_limit(url):
+    """
+    Sémaphore de concurrence de l'hôte d'une webhook (LIVRAISON_CONCURRENCE envois simultanés vers un même serveur)
+    """
+    host = urllib.parse.urlsplit(url or '').netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(livraison_concurrence)
+        return _host_limits[host]
+
+
+def post_json(url, body, target):
+    """
+    Poste un document JSON vers une webhook en réessayant (LIVRAISON_ESSAIS tentatives au total) 
+    sur les erreurs réseau et les réponses 429 / 5xx. 
+    La limite de concurrence de l'hôte n'est tenue que pendant chaque requête, pas pendant l'attente entre deux tentatives.
+    input :
+        url : webhook
+        body : document JSON encodé
+        target : nom du canal (métriques et logs)
+    output :
+        réponse de la dernière tentative
+    """
+    attempt = 1
+    while True:
+        response = None
+        try:
+            with host_limit(url):
+                response = http_session().post(url, data=body, headers={'Content-Type': 'application/json'}, timeout=HTTP_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt >= livraison_essais:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS or attempt >= livraison_essais:
+                return response
+        delay = retry_delay(response.headers.get('Retry-After') if response is not None else None, attempt)
+        count('reprises', target)
+        stdlog(f"Nouvelle tentative d'envoi {target} dans {delay:.1f}s" + (f" (HTTP {response.status_code})" if response is not None else ''))
+        time.sleep(delay)
+        attempt += 1
+
+
+def teams_body(nature, title, message):
+    """
+    Payload msteams (carte HTML) encodé, partagé par toutes les webhooks msteams destinataires du message
+    """
     # Create a connector card object
-    myTeamsMessage = pymsteams.connectorcard(webhook)
+    myTeamsMessage = pymsteams.connectorcard(None)
     # Prepare card object 
-    myTeamsMessage.text(message)              
+    myTeamsMessage.text(rendered(message, 'html'))              
     myTeamsMessage.title(title)
-    # Send the message
+    return json_dumps(myTeamsMessage.payload)
+
+
+def post_teams(webhook, body):
+    """
+    Envoi d'un payload msteams via la session partagée (connectorcard.send() ouvre une nouvelle connexion à chaque fois)
+    """
     try:
-        myTeamsMessage.send()
+        count('octets_envoyes', 'msteams', len(body))
+        response = post_json(webhook, body, 'msteams')
+        if response.status_code != 200:
+            raise pymsteams.TeamsWebhookException(response.text)
+        return True
     except pymsteams.TeamsWebhookException as e:
         print(f"Erreur à l'envoie du message MSTeams : {e}")
+        return False
 
 
-def tomattermost(nature,title,message):
-    if nature == "ATTRIBUTION":
-        webhook = "https://teams.mousqueton.io/hooks/x3p5pwniy3rr3q6ur7fxg6k8tw"
-    else: 
-        webhook = "https://teams.mousqueton.io/hooks/dh7s88q7nf8xbf5rnk7oxcxsqo"
-    # Prepare the payload
-    message = "**" + title + "**\n" + md(message).replace(':** *',":**\n*")
-    payload = {
+# Send message to Teams Channel regarding the nature of the message 
+def tomsteeams(nature,title,message,webhook=None):
+    return post_teams(webhook or teams_webhook(nature), teams_body(nature, title, message))
+
+
+def mattermost_payload(title, message):
+    """
+    Construit le message mattermost (Markdown) à partir du titre et du message rendu (cf render_message)
+    """
+    with timed('rendu_markdown'):
+        message = "**" + title + "**\n" + rendered(message, 'markdown')
+    return {
         'text': message,
         'username': "BOAMP-Alert",
         'icon_url': "https://raw.githubusercontent.com/JMousqueton/boamp-alert/main/.github/boamp.png"
     }
-    # Headers for the HTTP request
-    headers = {'Content-Type': 'application/json'}
-    # Perform the POST request to the Mattermost webhook
-    response = requests.post(webhook, data=json.dumps(payload), headers=headers)
+
+
+def mattermost_body(nature, title, message):
+    """
+    Payload mattermost encodé, partagé par toutes les webhooks mattermost destinataires du message
+    """
+    return json_dumps(mattermost_payload(title, message))
+
+
+def post_mattermost(webhook, body):
+    """
+    Envoi d'un payload mattermost
+    """
+    count('octets_envoyes', 'mattermost', len(body))
+    response = post_json(webhook, body, 'mattermost')
     # Check for error 
     if not response.status_code == 200: 
         stdlog(f"Failed to send message, status code: {response.status_code}")
+        return False
+    return True
+
 
+def tomattermost(nature,title,message,webhook=None):
+    return post_mattermost(webhook or mattermost_webhook(nature), mattermost_body(nature, title, message))
 
 
-def fetch_all_keywords(api_url):
+def replay_body(nature, title, message):
     """
-    recupère tous les mots clefs dans la base du BOAMP 
-    input : 
-        api_url 
-    output : 
-        liste des mots clefs 
+    Ligne JSON du mode --replay (payload mattermost, nature et titre)
     """
-    limit = 100
-    offset = 0
-    all_results = []
+    return json_dumps(dict(mattermost_payload(title, message), nature=nature, title=title))
 
-    while True:
-        # Update the offset in the URL
-        current_url = f"{api_url}&offset={offset}"
 
-        # Send an HTTP GET request to the updated URL
-        response = requests.get(current_url)
+def post_replay(webhook, body):
+    """
+    Sortie locale du mode --replay : une ligne JSON par message sur stdout ('-'), 
+    dans un fichier ou postée vers un stub HTTP local
+    """
+    if webhook.startswith(('http://', 'https://')):
+        with host_limit(webhook):
+            response = http_session().post(webhook, data=body, headers={'Content-Type': 'application/json'}, timeout=HTTP_TIMEOUT)
+        return response.status_code < 300
+    line = body + b'\n'
+    if webhook == '-':
+        # Un seul appel système par ligne pour ne pas mélanger les sorties des processus
+        os.write(sys.stdout.fileno(), line)
+    else:
+        with open(webhook, 'ab') as file:
+            file.write(line)
+    return True
 
-        # Check if the request was successful (status code 200)
-        if response.status_code == 200:
-            # Parse the JSON response
-            data = response.json()
 
-            # Extract and append results to the list
-            results = data.get('results', [])
-            all_results.extend(results)
+def toreplay(nature, title, message, webhook=None):
+    return post_replay(webhook or replay_webhook(nature), replay_body(nature, title, message))
 
-            # Check if there are more results
-            if len(results) < limit:
-                break  # No more results, exit the loop
 
-            # Increment the offset for the next request
-            offset += limit
+def replay_webhook(nature):
+    """
+    Destination unique du mode --replay
+    """
+    return replay_sortie
 
-        else:
-            stdlog("Erreur de récupuration des mots clef. Status code: "+ str(response.status_code))
-            break
-    return all_results
 
-def translate(word):
-    match word.lower():
-        case "quality":
-            return "Valeur Technique : "
-        case "price":
-            return "Prix : "
-        case "cost":
-            return "Prix : "
-        case "month":
-            return "mois"
-        case "year":
-            return "année(s)"
-        case "months":
-            return "mois"
-        case "years":
-            return "années"
-        case _:
-            return word
+# Canaux de diffusion : encodage du payload, envoi et choix de la webhook par défaut 
+SINKS = {
+    'msteams': (teams_body, post_teams, teams_webhook),
+    'mattermost': (mattermost_body, post_mattermost, mattermost_webhook),
+    'replay': (replay_body, post_replay, replay_webhook),
+}
 
 
-def parse_boamp_data(api_response, date):
+def sink_targets(nature, sinks):
     """
-    Parses the JSON response from the BOAMP API and extracts key information.
-    :param api_response: JSON response data from the BOAMP API.
-    :param date: Date string used for the filename.
+    Channels (canal, webhook) par défaut d'un message selon sa nature
+    """
+    return [(sink, SINKS[sink][2](nature)) for sink in sinks]
+
+
+def default_routes():
+    """
+    Table de routage équivalente aux webhooks du .env : les attributions d'un côté, les autres avis de l'autre
+    """
+    return [
+        {'nom': 'attributions', 'nature': ['ATTRIBUTION'], 'msteams': ms_webhook_attribution, 'mattermost': mattermost_webhook_attribution},
+        {'nom': 'avis de marché', 'defaut': True, 'msteams': ms_webhook_marche, 'mattermost': mattermost_webhook_marche},
+    ]
+
+
+def load_routes(path):
+    """
+    Lit la table de routage (cf routage.json.sample)
+    input :
+        path : fichier JSON, liste de règles {'nom', critères, 'msteams': webhook(s), 'mattermost': webhook(s)}
+    output :
+        liste des règles, None en cas d'erreur
     """
-    total_count = api_response.get('total_count', 0)
-    if total_count == 0:
-        stdlog('Pas de nouvel avis pour ' + date)
-        return
-      
-    stdlog(str(total_count) + ' enregistrement(s) récupéré(s)')
-    cptmsteams=0
-    cptmattermost=0 
-    # Write the response to a file
-    filename = f"data/boamp-{date}.json"
-    stdlog('Ecriture du fichier ' +  filename)
     try:
-        with open(filename, 'w') as file:
-            json.dump(api_response, file, indent=4)
-    except TypeError as e:
-        errlog(f"Error in JSON serialization: {e}")
-    except IOError as e:
-        errlog(f"File I/O error: {e}")
-
-    if total_count > 99:
-        stdlog("Plus de 100 résultats !!!")
-        toPushover("Il y a plus de 100 résultats")
-    stdlog('Extraction des données ...')
-    if 'results' in api_response and api_response['results']:
-        for record in api_response['results']:
-            """
-            Grab all data in variables 
-            """
-            nature = record.get('nature')
-            status = determine_status(nature)
-            ID = record.get('idweb', 'Non disponible')
-            acheteur = record.get('nomacheteur', 'Non disponible')
-            objet = record.get('objet', 'Non disponible')
-            services = record.get('descripteur_libelle')
-            services_clean = ', '.join(services)
-            services_list= services_clean.replace('Informatique (','').replace(')','')
-            pubdate =  record.get('dateparution', 'Non disponible')
-            typemarche = record.get('famille_libelle', 'Non disponible')
-            urlavis = record.get('url_avis', 'Not available')
-            ###
-            # Init variables
-            ###
-            montanttotal =''
-            avisinitial = ''
-            critere_pondere = ''
-            ref = ''
-            titulaire = ''
-            date_reception_offres = ''
-            dureemarche = ''
-            complement = ''
-            nblots = 0
-            correctif = ''
-            montant_par_lot = ''
-            descriptif_lots = ''
-            critere = ''
-            montant = ''
-            reponses_soumises = ''
-            reponses_soumises_list  = ''
-            titulaire_par_lot = ''
-            
-            ###
-            # Lecture des "données"  
-            ###
-            donnees_brut = record.get('donnees',{})
-            donnees = json.loads(donnees_brut)
-            
-
-            first_key = next(iter(donnees))
-            #### 
-            ##
-            ## MAPA ATTRIBUTION
-            ## 
-            ####
-            if first_key == "MAPA" and nature == "ATTRIBUTION":
-                try:
-                    avisinitial = donnees['MAPA']['attribution']['avisInitial']['idWeb']
-                except:
-                    avisinitial = ''
-                try:
-                    montant = donnees['MAPA']['attribution']['attribution']['resultat']['attribue']['montant']['valeur']
-                except:
-                    montant = ''
-                montanttotal = montant
-            #### 
-            ##
-            ## MAPA AVIS DE MARCHE 
-            ## 
-            ####
-            elif first_key == "MAPA" and nature == "APPEL_OFFRE":
-                try:
-                    duree_mois = donnees['MAPA']['initial']['natureMarche']['nbMois']
-                except:
-                    duree_mois = ''
-                try:
-                    date_reception_offres = donnees['MAPA']['initial']['delais']['receptionOffres']
-                    date_object = datetime.fromisoformat(date_reception_offres)
-                    date_reception_offres = date_object.strftime("%Y-%m-%d")
-                except: 
-                    date_reception_offres =''
-                try:
-                    ref = donnees['MAPA']['initial']['renseignements']['idMarche']
-                except: 
-                    ref =''
-                try:
-                    critere_pondere_list = donnees['MAPA']['initial']['criteres']['criterePondere']
-                    critere_pondere = "<strong>Critères d'attribution :</strong><ul>"
-                    for item in critere_pondere_list:
-                        critere_pondere += "<li>  " +  item['critere'] + " : " + item['criterePCT'] + "%</li>"
-                    critere_pondere += "</ul>\n\n"        
-                except:
-                    critere_pondere = ''
-            #### 
-            ##
-            ## MAPA RECTIFICATION 
-            ## 
-            ####
-            elif first_key == "MAPA" and nature == "RECTIFICATIF":
-                print("🛠️ A FAIRE : " + first_key + " " + nature)    
-                try: 
-                    correctif = donnees['MAPA']['rectificatif']['infosRectif']['rubrique']
-                    correctif += " : " + donnees['MAPA']['rectificatif']['infosRectif']['supprimer']
-                except:
-                    correct = ''
-                try:
-                    avisinitial = donnees['MAPA']['rectificatif']['avisInitial']['idWeb']
-                except:
-                    avisinitial = ''
-            ######################################
-                    
-            #### 
-            ##
-            ## FNSimple AVIS DE MARCHE 
-            ## 
-            ####
-            elif first_key == "FNSimple" and (nature == "APPEL_OFFRE" or nature == "ANNULATION"):
-                try:
-                    date_reception_offres = donnees['FNSimple']['initial']['procedure']['dateReceptionOffres']
-                    date_object = datetime.fromisoformat(date_reception_offres)
-                    date_reception_offres = date_object.strftime("%Y-%m-%d")
-                except: 
-                    date_reception_offres =''
-                try:
-                    dureemarche = donnees['FNSimple']['natureMarche']['dureeMois']
-                except:
-                    try: 
-                        dureemarche = donnees['FNSimple']['initial']['natureMarche']['dureeMois'] + ' mois'
-                    except:
-                        dureemarche = ''
-                try:
-                    valeur_haute = donnees['FNSimple']['natureMarche']['valeurEstimee']['fourchette']['valeurHaute']
-                except:
-                    try:
-                        valeur_haute = donnees['FNSimple']['initial']['natureMarche']['valeurEstimee']['fourchette']['valeurHaute']
-                    except:
-                        valeur_haute = ''
-                montanttotal = valeur_haute
-            #### 
-            ##
-            ## FNSimple ATTRIBUTION 
-            ## 
-            ####
-            elif first_key == "FNSimple" and nature == "ATTRIBUTION":
-                print("🛠️ [" + ID + "] A FINIR : " + first_key + " " + nature)
-                try:
-                    avisinitial = donnees['FNSimple']['attribution']['avisInitial']['idWeb']
-                except:
-                    avisinitial = ''
-                try: 
-                    complement = donnees['FNSimple']['attribution']['attributionMarche']
-                except:
-                    complement =''
-            #### 
-            ##
-            ## FNSimple RECTIFICATION 
-            ## 
-            ####
-            elif first_key == "FNSimple" and nature == "RECTIFICATIF":
-                print("🛠️ [" + ID + "] A FINIR : " + first_key + " " + nature)
-                try:
-                    avisinitial = donnees['FNSimple']['rectificatif']['avisInitial']['idWeb']  
-                except:
-                    avisinitial = ''
-            ######################################
-                    
-                    
-            #### 
-            ##
-            ## EFORMS AVIS DE MARCHE 
-            ## 
-            ####
-            elif first_key == "EFORMS" and nature == "APPEL_OFFRE":
-                print("🛠️ [" + ID + "] A FINIR : " + first_key + " " + nature)
-                try: 
-                    for org in donnees["EFORMS"]["ContractNotice"]["ext:UBLExtensions"]["ext:UBLExtension"]["ext:ExtensionContent"]["efext:EformsExtension"]["efac:Organizations"]["efac:Organization"]:
-                        if "efbc:AwardingCPBIndicator" in org and org["efbc:AwardingCPBIndicator"] == "true":
-                            acheteur = org["efac:Company"]["cac:PartyName"]["cbc:Name"]["#text"]
-                except:
-                    pass
-                if "Tribunal" in acheteur: 
-                    try:
-                        for organization in donnees['EFORMS']['ContractNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:Organizations']['efac:Organization']:
-                            company_name = organization['efac:Company']['cac:PartyName']['cbc:Name']['#text']
-                            if "Tribunal" not in company_name:
-                                acheteur = company_name
-                    except:
-                        pass
-                try: 
-                    procurement_projects = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']
-                    nblots = sum('cbc:ID' in project for project in procurement_projects)
-                except:
-                    nblots = ''
-                if nblots == 1:
-                    try:
-                        critere_pondere_list = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']['cac:TenderingTerms']['cac:AwardingTerms']['cac:AwardingCriterion']['cac:SubordinateAwardingCriterion']
-                        critere_pondere =  '<strong>Critères : </strong><ul>'
-                        for item in critere_pondere_list:
-                            critere_pondere  += "<li>"
-                            critere_nom = item['cbc:AwardingCriterionTypeCode']['#text']
-                            critere_valeur = item['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:AwardCriterionParameter']['efbc:ParameterNumeric']
-                            # for key, value in item.items():
-                            critere_pondere += translate(critere_nom) + str(critere_valeur) + "% "
-                            critere_pondere += "</li>"
-                        critere_pondere += "</ul>\n\n"    
-                    except:
-                            try:
-                                critere_pondere = "<strong>Critères : </strong>"
-                                critere_pondere += donnees ['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']['cac:TenderingTerms']['cac:AwardingTerms']['cac:AwardingCriterion']['cbc:Description']['#text']
-                                critere_pondere += "\n\n"
-                            except:
-                                critere_pondere = ''
-                    try:
-                        montanttotal = donnees['EFORMS']['ContractNotice']['cac:ProcurementProject']['cac:RequestedTenderTotal']['cbc:EstimatedOverallContractAmount']['#text']
-                    except:
-                        try:
-                            montanttotal = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']['cac:ProcurementProject']['cac:RequestedTenderTotal']['cbc:EstimatedOverallContractAmount']['#text']    
-                        except:
-                            montanttotal = ''                           
-                    
-                if nblots > 1:
-                    try:
-                        critere_pondere = "<strong>Critères d'attribution :</strong><ul>"
-                        for i in range(nblots):
-                            critere_pondere_list = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot'][i]['cac:TenderingTerms']['cac:AwardingTerms']['cac:AwardingCriterion']['cbc:Description']['#text']
-                            try:
-                                descriptif = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot'][i]['cac:ProcurementProject']['cbc:Name']['#text'] + "<BR>"
-                            except:
-                                descriptif = ''
-                            critere_pondere += "<li> Lot n°" + str(i+1) + " : " + descriptif + str(critere_pondere_list) + "</li>"
-                        critere_pondere += "</ul>\n\n"
-                    except:
- 
-                        try:
-                            critere_pondere_list = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']['cac:TenderingTerms']['cac:AwardingTerms']['cac:AwardingCriterion']['cac:SubordinateAwardingCriterion']
-                            critere_pondere =  '<strong>Critères : </strong><ul>'
-                            for item in critere_pondere_list:
-                                critere_pondere  += "<li>"
-                                for key, value in item.items():
-                                    critere_pondere += translate(value.get('#text', ''))
-                                critere_pondere += "</li>"
-                            critere_pondere += "</ul>\n\n"    
-                        except:
-                                critere_pondere = ''
-                try:
-                    duree = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']['cac:ProcurementProject']['cac:PlannedPeriod']['cbc:DurationMeasure']['#text']
-                    unite = translate(donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']['cac:ProcurementProject']['cac:PlannedPeriod']['cbc:DurationMeasure']['@unitCode'])
-                    dureemarche = duree + ' ' + unite 
-                except:
-                    try:
-                        dureemarche = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot']['cac:ProcurementProject']['cac:ContractExtension']['cac:Renewal']['cac:Period']['cbc:Description']['#text']
-                    except:
-                        dureemarche = ''
-                if not montanttotal:
-                    try:
-                        montanttotal = donnees['EFORMS']['ContractNotice']['cac:ProcurementProject']['cac:RequestedTenderTotal']['cbc:EstimatedOverallContractAmount']['#text'] 
-                    except:
-                        try:
-                            montant_par_lot = "<strong>Montant du marché :</strong><ul>"
-                            montanttotal = 0 
-                            for i in range(nblots):
-                                valeur = donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot'][i]['cac:ProcurementProject']['cac:RequestedTenderTotal']['cbc:EstimatedOverallContractAmount']['#text']
-                                montant_par_lot += "<li> Lot n°" + str(i+1) + " : " + format_large_number(str(valeur)) + "€</li>"
-                                montanttotal += float(valeur)
-                            montant_par_lot += "</ul>\n\n"
-                        except:
-                            montant_par_lot =''
-                try:
-                    descriptif_lots = '<strong>Description des lots :</strong><BR><ul>'
-                    for i in range(nblots):
-                        descriptif_lot =  donnees['EFORMS']['ContractNotice']['cac:ProcurementProjectLot'][i]['cac:ProcurementProject']['cbc:Description']['#text']
-                        descriptif_lots += "<li> Lot n°" + str(i+1) + " : " + descriptif_lot +"</li>"
-                    descriptif_lots += "</ul>\n\n"
-                except:
-                    descriptif_lots = ''
-
-            #### 
-            ##
-            ## EFORMS ATTRIBUTION
-            ## 
-            ####
-            elif first_key == "EFORMS" and nature == "ATTRIBUTION":
-                try:
-                    
-                    lots = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotResult']
-                    nblots = sum('cbc:ID' in lot for lot in lots)
-                except: 
-                    nblots = ''
-                try:
-                    titulaire = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotTender']['efac:TenderReference']['cbc:ID']
-                except:
-                    titulaire = ''
-                try: 
-                    critere = donnees['EFORMS']['ContractAwardNotice']['cac:ProcurementProjectLot']['cac:TenderingTerms']['cac:AwardingTerms']['cac:AwardingCriterion']['cbc:CalculationExpression']['#text']
-                except:
-                    critere = ''
-                try:
-                    montant = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['cbc:TotalAmount']['#text']
-                except:
-                    try:
-                        montant = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotTender']['cac:LegalMonetaryTotal']['cbc:PayableAmount']['#text']
-                    except:
-                        montant = ''
-                try:
-                    critere_pondere_list = donnees['EFORMS']['ContractAwardNotice']['cac:ProcurementProjectLot']['cac:TenderingTerms']['cac:AwardingTerms']['cac:AwardingCriterion']['cac:SubordinateAwardingCriterion']
-                    critere_pondere =  '<strong>Critères : </strong><ul>'
-                    for item in critere_pondere_list:
-                        critere_pondere  += "<li>"
-                        critere_nom = item['cbc:AwardingCriterionTypeCode']['#text']
-                        critere_valeur = item['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:AwardCriterionParameter']['efbc:ParameterNumeric']
-                        # for key, value in item.items():
-                        critere_pondere += translate(critere_nom) + str(critere_valeur) + "% "
-                        critere_pondere += "</li>"
-                    critere_pondere += "</ul>\n\n"    
-                except:
-                    try:
-                        critere_pondere = "<strong>Critères : </strong>"
-                        critere_pondere += donnees['EFORMS']['ContractAwardNotice']['cac:ProcurementProjectLot']['cac:TenderingTerms']['cac:AwardingTerms']['cac:AwardingCriterion']['cbc:Description']['#text']
-                        critere_pondere += "\n\n"
-                    except:
-                         critere_pondere = ''
-                if nblots > 1:
-                    try:
-                        reponses_soumises_list = "<strong>Réponses reçues par lots : </strong><ul>"
-                        for i in range(nblots):
-                            if donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotResult'][i]['efac:ReceivedSubmissionsStatistics'][0]['efbc:StatisticsCode']['@listName'] == 'received-submission-type':
-                                reponses_soumises_par_lot =  donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotResult'][i]['efac:ReceivedSubmissionsStatistics'][0]['efbc:StatisticsNumeric']
-                                reponses_soumises_list += "<li> Lot n°" + str(i+1) + " : " +  str(reponses_soumises_par_lot) + "</li>"
-                        reponses_soumises_list += "</ul>\n\n"  
-                    except: #Exception as e: print(e)
-                        reponses_soumises_list = ''  
-                    try:
-                        montant_par_lot = "<strong>Montant du marché :</strong><ul>"
-                        montant = 0 
-                        for i in range(nblots):
-                            valeur = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotTender'][i]['cac:LegalMonetaryTotal']['cbc:PayableAmount']['#text']
-                            montant_par_lot += "<li> Lot n°" + str(i+1) + " : " + format_large_number(str(valeur)) + "€</li>"
-                            montant += float(valeur)
-                        montant_par_lot += "</ul>\n\n"
-                    except:
-                        try:
-                            montant_par_lot = "<strong>Montant du marché :</strong><ul>"
-                            montant = 0 
-                            for i in range(nblots):
-                                valeur = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotTender'][i]['cac:LegalMonetaryTotal']['cbc:PayableAmount']['#text']
-                                montant_par_lot += "<li> Lot n°" + str(i+1) + " : " + format_large_number(str(valeur)) + "€</li>"
-                                montant += float(valeur)
-                            montant_par_lot += "</ul>\n\n"
-                        except:
-                            montant_par_lot =''
-                    try:
-                        titulaire_par_lot = "<strong>Titulaire par lot :</strong><ul>"
-                        for i in range(nblots):
-                            titulaire_nom = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotTender'][i]['efac:TenderReference']['cbc:ID']
-                            titulaire_par_lot += "<li> Lot n°" + str(i+1) + " : " + titulaire_nom+ "</li>"
-                        titulaire_par_lot += "</ul>\n\n"
-                    except:
-                        titulaire_par_lot =''
-                    try:
-                        descriptif_lots = "<strong>Descriptif des lots :</strong><ul>"
-                        for i in range(nblots):
-                            descriptif_lot = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:SettledContract'][i]['cbc:Title']['#text']
-                            if "Lot n" in descriptif_lot:
-                                descriptif_lots += "<li>"+ descriptif_lot + "</li>"
-                            else: 
-                                descriptif_lots += "<li> Lot n°" + str(i+1) + " : " + descriptif_lot+ "</li>"
-                        descriptif_lots += "</ul>\n\n"
-                    #except:
-                    #    descriptif_lots = ''
-                    except Exception as e: print(e)
-                        
-                try:
-                    if donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotResult']['efac:ReceivedSubmissionsStatistics'][0]['efbc:StatisticsCode']['@listName'] == 'received-submission-type':
-                        reponses_soumises = donnees['EFORMS']['ContractAwardNotice']['ext:UBLExtensions']['ext:UBLExtension']['ext:ExtensionContent']['efext:EformsExtension']['efac:NoticeResult']['efac:LotResult']['efac:ReceivedSubmissionsStatistics'][0]['efbc:StatisticsNumeric']
-                except: # Exception as e: print(e)
-                    reponses_soumises = ''
+        with open(path, 'rb') as file:
+            rules = json_loads(file.read())
+        if not isinstance(rules, list):
+            raise ValueError('une liste de règles est attendue')
+        for rule in rules:
+            unknown = set(rule) - set(ROUTE_KEYS)
+            if unknown:
+                raise ValueError('critère(s) inconnu(s) ' + ', '.join(sorted(unknown)) + ' dans la règle ' + str(rule.get('nom')))
+            if not any(rule.get(sink) for sink in ('msteams', 'mattermost')):
+                raise ValueError('aucune webhook msteams ou mattermost dans la règle ' + str(rule.get('nom')))
+            for key in ('montant_min', 'montant_max'):
+                if key in rule:
+                    float(rule[key])
+    except (OSError, ValueError, TypeError) as e:
+        errlog("Erreur de lecture de la table de routage " + path + " : " + str(e))
+        return None
+    return rules
+
+
+# Clefs d'une règle de routage : critères (tous doivent être vérifiés, une des valeurs de chaque liste suffit) et destinations
+ROUTE_KEYS = ('nom', 'defaut', 'nature', 'descripteurs', 'tranches', 'montant_min', 'montant_max', 
+              'departements', 'acheteurs', 'msteams', 'mattermost')
+
+
+def compile_routes(rules):
+    """
+    Compile la table de routage : ensembles pour les natures, descripteurs et tranches, seuils convertis, 
+    une expression régulière par règle pour les acheteurs (sans casse ni accents)
+    input :
+        rules : règles (cf load_routes ou default_routes)
+    output :
+        dictionnaire {'rules': règles compilées, 'sinks': canaux utilisés}
+    """
+    compiled = []
+    sinks = []
+    for rule in rules:
+        targets = []
+        for sink in ('msteams', 'mattermost'):
+            webhooks = rule.get(sink) or []
+            for webhook in ([webhooks] if isinstance(webhooks, str) else webhooks):
+                if webhook:
+                    targets.append((sink, webhook))
+                    if sink not in sinks:
+                        sinks.append(sink)
+        if not targets:
+            continue
+        acheteurs = [normalize_keyword(name.strip()) for name in rule.get('acheteurs', []) if name.strip()]
+        compiled.append({
+            'nom': rule.get('nom', ''),
+            'defaut': bool(rule.get('defaut')),
+            'natures': set(rule['nature']) if rule.get('nature') else None,
+            'codes': {str(code) for code in rule['descripteurs']} if rule.get('descripteurs') else None,
+            'tranches': set(rule['tranches']) if rule.get('tranches') else None,
+            'montant_min': float(rule['montant_min']) if rule.get('montant_min') is not None else None,
+            'montant_max': float(rule['montant_max']) if rule.get('montant_max') is not None else None,
+            'departements': tuple(str(code) for code in rule['departements']) if rule.get('departements') else None,
+            'acheteurs': re.compile('|'.join(re.escape(name) for name in acheteurs)) if acheteurs else None,
+            'targets': targets,
+        })
+    return {'rules': compiled, 'sinks': sinks}
+
+
+def route_notice(notice, routing, classifier):
+    """
+    Channels destinataires d'un avis : toutes les règles dont les critères sont vérifiés, 
+    à défaut les règles 'defaut'. Les informations de l'avis ne sont calculées qu'une fois, à la demande.
+    input :
+        notice : avis structuré (cf build_notice)
+        routing : table de routage compilée (cf compile_routes)
+        classifier : règles de logos pour les tranches de montant (cf compile_logos)
+    output :
+        liste dédoublonnée des channels (canal, webhook)
+    """
+    facts = {}
+
+    def fact(name):
+        if name not in facts:
+            if name == 'codes':
+                facts[name] = {str(code) for code, libelle in notice['descripteurs']}
+            elif name == 'montant':
+                facts[name] = to_float(notice['montanttotal']) or to_float(notice['montant'])
+            elif name == 'tranche':
+                facts[name] = amount_logo(notice['nature'], notice['typemarche'], notice['montanttotal'], classifier)
+            elif name == 'acheteur':
+                facts[name] = normalize_keyword(notice['acheteur'] or '')
+        return facts[name]
+
+    def matches(rule):
+        if rule['natures'] is not None and notice['nature'] not in rule['natures']:
+            return False
+        if rule['codes'] is not None and rule['codes'].isdisjoint(fact('codes')):
+            return False
+        if rule['tranches'] is not None and fact('tranche') not in rule['tranches']:
+            return False
+        if rule['montant_min'] is not None or rule['montant_max'] is not None:
+            amount = fact('montant')
+            if amount is None:
+                return False
+            if rule['montant_min'] is not None and amount < rule['montant_min']:
+                return False
+            if rule['montant_max'] is not None and amount > rule['montant_max']:
+                return False
+        if rule['departements'] is not None and not any(code in rule['departements'] for code in notice['departements']):
+            return False
+        if rule['acheteurs'] is not None and not rule['acheteurs'].search(fact('acheteur')):
+            return False
+        return True
+
+    targets = []
+    for rule in routing['rules']:
+        if not rule['defaut'] and matches(rule):
+            targets.extend(rule['targets'])
+    if not targets:
+        for rule in routing['rules']:
+            if rule['defaut'] and matches(rule):
+                targets.extend(rule['targets'])
+    return list(dict.fromkeys(targets))
+
+
+_last_sends = {} # Instant du dernier envoi par channel (canal, webhook)
+
+def deliver_channel(sink, webhook, items):
+    """
+    Envoie dans l'ordre les messages d'un channel en respectant le débit maximum
+    input :
+        sink : nom du canal de diffusion (cf SINKS)
+        webhook : webhook du channel
+        items : liste ordonnée de tuples (pubdate, nature, title, message, body), body étant le payload encodé
+    output :
+        nombre de messages envoyés, liste des messages en échec
+    """
+    post = SINKS[sink][1]
+    interval = 1.0 / livraison_debit if livraison_debit > 0 else 0
+    # Dernier envoi conservé d'un appel à l'autre : les lots successifs d'une journée respectent aussi le débit
+    last_send = _last_sends.get((sink, webhook), 0.0)
+    sent = 0
+    failed = []
+    for pubdate, nature, title, message, body in items:
+        wait = last_send + interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        last_send = time.monotonic()
+        count('requetes', sink)
+        try:
+            with timed('envoi_' + sink):
+                delivered = post(webhook, body)
+        except requests.exceptions.RequestException as e:
+            errlog(f"Erreur à l'envoi du message {sink} : {e}")
+            delivered = False
+        if delivered:
+            sent += 1
+        else:
+            count('echecs', sink)
+            failed.append((sink, webhook, pubdate, nature, title, message))
+    _last_sends[(sink, webhook)] = last_send
+    return sent, failed
+
+
+def deliver(envois):
+    """
+    Envoie les messages rendus vers les canaux de diffusion via un pool de workers.
+    Chaque channel (canal + webhook) est traité dans l'ordre de publication,
+    les channels sont traités en parallèle.
+    input :
+        envois : liste de tuples (pubdate, title, message, nature, targets), 
+                 targets étant la liste des channels (canal, webhook) destinataires (cf sink_targets)
+    output :
+        dictionnaire {canal: nombre de messages envoyés}, 
+        liste des messages en échec (sink, webhook, pubdate, nature, title, message)
+    """
+    channels = {}
+    for pubdate, title, message, nature, targets in sorted(envois, key=lambda envoi: envoi[0]):
+        # Un message destiné plusieurs fois au même channel n'est envoyé qu'une fois, 
+        # et son payload n'est encodé qu'une fois par canal quel que soit le nombre de webhooks
+        bodies = {}
+        for sink, webhook in dict.fromkeys(targets):
+            if sink not in bodies:
+                bodies[sink] = SINKS[sink][0](nature, title, message)
+            channels.setdefault((sink, webhook), []).append((pubdate, nature, title, message, bodies[sink]))
+
+    sent = {}
+    failed = []
+    if not channels:
+        return sent, failed
+    with ThreadPoolExecutor(max_workers=livraison_workers) as executor:
+        futures = {executor.submit(deliver_channel, sink, webhook, items): sink for (sink, webhook), items in channels.items()}
+        for future, sink in futures.items():
+            channel_sent, channel_failed = future.result()
+            sent[sink] = sent.get(sink, 0) + channel_sent
+            failed.extend(channel_failed)
+    return sent, failed
+
+
+_dead_letter_lock = threading.Lock()
+
+def spool_dead_letters(failed, attempts=1):
+    """
+    Ajoute au spool (data/deadletter.jsonl) les messages qui n'ont pas pu être envoyés
+    input :
+        failed : liste de tuples (sink, webhook, pubdate, nature, title, message)
+        attempts : nombre d'exécutions ayant déjà tenté l'envoi
+    """
+    # Le mode --replay n'écrit rien dans data/
+    failed = [item for item in failed if item[0] != 'replay']
+    if not failed:
+        return
+    with _dead_letter_lock, open(DEAD_LETTER_FILE, 'ab') as file:
+        for sink, webhook, pubdate, nature, title, message in failed:
+            file.write(json_dumps({'sink': sink, 'webhook': webhook, 'pubdate': pubdate, 'nature': nature, 'title': title, 
+                                   'message': message, 'tentatives': attempts}) + b'\n')
+    errmsg = str(len(failed)) + " message(s) non envoyé(s) mis en attente dans " + DEAD_LETTER_FILE
+    stdlog(errmsg)
+    toPushover(errmsg)
+
+
+def drain_dead_letters():
+    """
+    Renvoie en priorité les messages du spool. Ceux qui échouent encore y retournent, 
+    jusqu'à LIVRAISON_RENVOIS_MAX exécutions.
+    """
+    draining = DEAD_LETTER_FILE + '.envoi'
+    entries = []
+    with _dead_letter_lock:
+        # Un fichier .envoi restant correspond à un renvoi interrompu : il est repris
+        for path in (draining, DEAD_LETTER_FILE):
+            try:
+                with open(path, 'rb') as file:
+                    entries.extend(json_loads(line) for line in file if line.strip())
+            except FileNotFoundError:
+                pass
+        if not entries:
+            return
+        with open(draining + '.tmp', 'wb') as file:
+            file.writelines(json_dumps(entry) + b'\n' for entry in entries)
+        os.replace(draining + '.tmp', draining)
+        if os.path.exists(DEAD_LETTER_FILE):
+            os.remove(DEAD_LETTER_FILE)
+
+    stdlog(str(len(entries)) + ' message(s) en attente à renvoyer')
+    unknown = [entry for entry in entries if entry['sink'] not in SINKS]
+    for sink in dict.fromkeys(entry['sink'] for entry in unknown):
+        errlog('Canal inconnu ' + sink + ' : ' + str(sum(entry['sink'] == sink for entry in unknown)) + ' message(s) abandonné(s)')
+    envois = []
+    attempts = {}
+    for entry in entries:
+        if entry['sink'] not in SINKS:
+            continue
+        # Les entrées sans webhook (versions précédentes) sont renvoyées vers la webhook par défaut
+        target = (entry['sink'], entry.get('webhook') or SINKS[entry['sink']][2](entry['nature']))
+        envois.append((entry['pubdate'], entry['title'], entry['message'], entry['nature'], [target]))
+        attempts[target + (entry['pubdate'], entry['title'])] = entry['tentatives']
+    sent, failed = deliver(envois)
+    for item in failed:
+        previous = attempts[item[:3] + (item[4],)]
+        if previous >= livraison_renvois_max:
+            errmsg = 'Message abandonné après ' + str(previous + 1) + ' exécutions : ' + item[4]
+            errlog(errmsg)
+            toPushover(errmsg)
+        else:
+            spool_dead_letters([item], previous + 1)
+    stdlog(str(sum(sent.values())) + ' message(s) en attente renvoyé(s)')
+    os.remove(draining)
+
+
+def fetch_keywords_page(offset, headers=None):
+    """
+    Récupère une page du catalogue des mots clefs (descripteurs) du BOAMP
+    input :
+        offset : position du premier mot clef de la page
+        headers : en-têtes de la requête (requête conditionnelle)
+    output :
+        réponse HTTP
+    """
+    count('requetes', 'motsclefs')
+    with timed('recuperation_motsclefs'):
+        response = http_session().get(KEYWORDS_API_URL, params=dict(KEYWORDS_PARAMS, limit=PAGE_SIZE, offset=offset), 
+                                      headers=headers, timeout=HTTP_TIMEOUT)
+    count('octets_recus', 'motsclefs', len(response.content))
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
+
+
+def fetch_all_keywords(response=None):
+    """
+    recupère tous les mots clefs dans la base du BOAMP : la première page donne le nombre total, 
+    les pages suivantes sont récupérées en parallèle
+    input :
+        response : première page déjà récupérée (revalidation du cache), sinon elle est demandée
+    output : 
+        liste des mots clefs, ETag et Last-Modified de la première page
+    """
+    if response is None:
+        response = fetch_keywords_page(0)
+    data = json_loads(response.content)
+    all_results = data.get('results', [])
+    offsets = range(PAGE_SIZE, min(data.get('total_count', 0), MAX_RECORDS), PAGE_SIZE)
+    with ThreadPoolExecutor(max_workers=pagination_workers) as executor:
+        for page in executor.map(fetch_keywords_page, offsets):
+            all_results.extend(json_loads(page.content).get('results', []))
+    all_results = [{'mc_code': result.get('mc_code', ''), 'mc_libelle': result.get('mc_libelle', '')} for result in all_results]
+    return all_results, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+def normalize_keyword(text):
+    """
+    Minuscules sans accents pour la recherche par préfixe
+    """
+    return ''.join(char for char in unicodedata.normalize('NFKD', text.lower()) if not unicodedata.combining(char))
+
+
+def keyword_catalogue(results):
+    """
+    Construit le catalogue des mots clefs
+    output :
+        dictionnaire {'labels': {code: libellé}, 'words': liste triée de tuples (mot normalisé, code)}
+    """
+    labels = {}
+    words = set()
+    for result in results:
+        code = str(result['mc_code'])
+        labels[code] = result['mc_libelle']
+        for word in re.findall(r'\w+', normalize_keyword(result['mc_libelle'])):
+            words.add((word, code))
+    return {'labels': labels, 'words': sorted(words)}
+
+
+def search_keywords(catalogue, prefix):
+    """
+    Recherche les mots clefs dont un mot du libellé commence par prefix (sans tenir compte de la casse ni des accents)
+    output :
+        liste triée par libellé de tuples (code, libellé)
+    """
+    prefix = normalize_keyword(prefix.strip())
+    words = catalogue['words']
+    codes = set()
+    for word, code in islice(words, bisect.bisect_left(words, (prefix,)), None):
+        if not word.startswith(prefix):
+            break
+        codes.add(code)
+    return sorted(((code, catalogue['labels'][code]) for code in codes), key=lambda item: item[1])
+
+
+def load_keywords(force=False):
+    """
+    Charge le catalogue des mots clefs depuis le cache disque (data/motsclefs.json). 
+    Au-delà de MOTSCLEFS_TTL heures le cache est revalidé par une requête conditionnelle 
+    (ETag / Last-Modified de la première page) et récupéré à nouveau s'il a changé.
+    En cas d'erreur réseau le cache existant est utilisé.
+    input :
+        force : ignore la durée de validité du cache
+    output :
+        catalogue (cf keyword_catalogue), None si indisponible
+    """
+    cache = catalogue = None
+    try:
+        with open(KEYWORDS_CACHE_FILE, 'rb') as file:
+            cache = json_loads(file.read())
+        catalogue = keyword_catalogue(cache['results'])
+        cache_age = time.time() - float(cache['date'])
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        errlog("Cache des mots clefs " + KEYWORDS_CACHE_FILE + " illisible (" + str(e) + "), récupération du catalogue")
+        cache = catalogue = None
+    now = time.time()
+    if catalogue and not force and cache_age < motsclefs_ttl * 3600:
+        return catalogue
+
+    try:
+        first_page = None
+        if catalogue and (cache.get('etag') or cache.get('last_modified')):
+            headers = {}
+            if cache.get('etag'):
+                headers['If-None-Match'] = cache['etag']
+            if cache.get('last_modified'):
+                headers['If-Modified-Since'] = cache['last_modified']
+            first_page = fetch_keywords_page(0, headers)
+            if first_page.status_code == 304:
+                dbglog('Catalogue des mots clefs inchangé')
+                cache['date'] = now
+                write_keywords_cache(cache)
+                return catalogue
+        stdlog('Récupération du catalogue des mots clefs')
+        # La réponse de la revalidation est la première page du catalogue : elle n'est pas redemandée
+        results, etag, last_modified = fetch_all_keywords(first_page)
+    except requests.exceptions.RequestException as e:
+        errlog("Erreur de récupération des mots clefs : " + str(e))
+        return catalogue
+    write_keywords_cache({'date': now, 'etag': etag, 'last_modified': last_modified, 'results': results})
+    return keyword_catalogue(results)
+
+
+def write_keywords_cache(cache):
+    """
+    Enregistre le cache des mots clefs (écriture atomique)
+    """
+    tmp_path = KEYWORDS_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(json_dumps(cache))
+    os.replace(tmp_path, KEYWORDS_CACHE_FILE)
+
+
+def load_watchlists(path):
+    """
+    Lit les listes de surveillance (cf listes.json.sample)
+    input :
+        path : fichier JSON {nom: {'mots': [...], 'descripteurs': [...], 'msteams': webhook, 'mattermost': webhook}}
+    output :
+        dictionnaire des listes, None en cas d'erreur
+    """
+    try:
+        with open(path, 'rb') as file:
+            config = json_loads(file.read())
+    except (OSError, ValueError) as e:
+        errlog("Erreur de lecture des listes de surveillance " + path + " : " + str(e))
+        return None
+    for name, rule in config.items():
+        if not (rule.get('mots') or rule.get('descripteurs')):
+            errlog("Liste de surveillance " + name + " : aucun mot ni descripteur")
+            return None
+        if not any(rule.get(sink) for sink in ('msteams', 'mattermost')):
+            errlog("Liste de surveillance " + name + " : aucune webhook msteams ou mattermost")
+            return None
+    return config
+
+
+def watch_fragment(word):
+    """
+    Expression d'un mot ou d'une expression surveillée : sans casse ni accents, 
+    espaces quelconques entre les mots, '*' final pour un préfixe (cyber* : cybersécurité, cyberattaque, ...)
+    """
+    prefix = word.strip().endswith('*')
+    words = normalize_keyword(word.strip().rstrip('*')).split()
+    return r'\s+'.join(re.escape(w) for w in words) + (r'\w*' if prefix else '')
+
+
+def compile_watchlists(config, default_codes):
+    """
+    Compile les listes de surveillance en une seule expression régulière et une table des descripteurs, 
+    pour parcourir chaque avis une seule fois quel que soit le nombre de règles. 
+    À chaque début de mot trouvé, un groupe par liste (recherche en avant) indique les listes dont un mot commence à cet endroit : 
+    les mots de plusieurs listes peuvent ainsi se chevaucher (centre hospitalier / hospitalier)
+    input :
+        config : listes de surveillance (cf load_watchlists)
+        default_codes : descripteurs des webhooks par défaut (DESCRIPTEURS)
+    output :
+        dictionnaire {'regex', 'names', 'codes', 'default_codes', 'targets'}
+    """
+    fragments = {}
+    codes = {}
+    targets = {}
+    for name, rule in config.items():
+        targets[name] = [(sink, rule[sink]) for sink in ('msteams', 'mattermost') if rule.get(sink)]
+        for word in rule.get('mots', []):
+            if normalize_keyword(word.strip().rstrip('*')).split():
+                fragments.setdefault(name, set()).add(watch_fragment(word))
+        for code in rule.get('descripteurs', []):
+            codes.setdefault(str(code).strip(), set()).add(name)
+    names = list(fragments)
+    regex = None
+    if names:
+        # Les plus longues d'abord : l'alternative retenue est la première qui correspond
+        alternatives = ['|'.join(sorted(fragments[name], key=len, reverse=True)) for name in names]
+        regex = re.compile(r'\b(?=(?:' + '|'.join(alternatives) + r')\b)' + 
+                           ''.join(r'(?:(?=(' + alternative + r')\b))?' for alternative in alternatives))
+    return {'regex': regex, 'names': names, 'codes': codes, 
+            'default_codes': set(default_codes), 'targets': targets}
+
+
+def match_record(record):
+    """
+    Confronte un enregistrement aux DESCRIPTEURS et aux listes de surveillance :
+    un seul parcours de l'objet, des libellés des descripteurs et du nom de l'acheteur
+    output :
+        (True si l'avis correspond aux DESCRIPTEURS, ensemble des listes de surveillance concernées)
+    """
+    codes = [str(code) for code in record.get('descripteur_code') or []]
+    default = any(code in watchlists['default_codes'] for code in codes)
+    names = set()
+    for code in codes:
+        names.update(watchlists['codes'].get(code, ()))
+    if watchlists['regex'] is not None:
+        text = normalize_keyword('\n'.join([record.get('objet') or '', 
+                                             '\n'.join(record.get('descripteur_libelle') or []), 
+                                             record.get('nomacheteur') or '']))
+        for match in watchlists['regex'].finditer(text):
+            names.update(name for name, found in zip(watchlists['names'], match.groups()) if found is not None)
+    return default, names
+
+
+def translate(word):
+    match word.lower():
+        case "quality":
+            return "Valeur Technique : "
+        case "price":
+            return "Prix : "
+        case "cost":
+            return "Prix : "
+        case "month":
+            return "mois"
+        case "year":
+            return "année(s)"
+        case "months":
+            return "mois"
+        case "years":
+            return "années"
+        case _:
+            return word
+
+
+###
+# Rendu des messages : un avis est décrit par une liste de blocs, rendus directement 
+# en HTML (Teams) et en Markdown (Mattermost) avec les gabarits ci-dessous
+###
+
+# Blocs :
+#   ('gras', texte)                     ligne en gras
+#   ('champ', libellé, valeur)          libellé en gras suivi de la valeur
+#   ('url', libellé, url)               libellé en gras suivi d'une adresse (non échappée en Markdown)
+#   ('lien', libellé, url, texte)       libellé en gras suivi d'un lien
+#   ('section', libellé, texte)         libellé en gras puis paragraphe
+#   ('liste', libellé, lignes, saut)    libellé en gras puis liste à puces, chaque élément étant un tuple de lignes 
+#                                       (saut : retour à la ligne HTML entre le libellé et la liste)
+#   ('ligne', [(libellé, valeur)])      champs sur une même ligne
+#   ('texte', texte)                    paragraphe
+TEMPLATES = {
+    'html': {
+        'gras': '<strong>{0}</strong>\n\n'.format,
+        'champ': '<strong>{0}</strong>{1}\n\n'.format,
+        'url': '<strong>{0}</strong> {1}\n\n'.format,
+        'lien': '<strong>{0}</strong><a href="{1}">{2}</a>\n\n'.format,
+        'section': '<strong>{0}</strong>\n\n{1}\n\n'.format,
+        'liste': '<strong>{0}</strong>{1}<ul>{2}</ul>\n\n'.format,
+        'element': '<li>{0}</li>'.format,
+        'ligne_champ': '<strong>{0}</strong>{1}'.format,
+        'texte': '{0}\n\n'.format,
+        'saut': '<BR>',
+        'separateur': ' | ',
+    },
+    'markdown': {
+        'gras': '**{0}**\n\n'.format,
+        'champ': '**{0}** {1}\n\n'.format,
+        'url': '**{0}** {1}\n\n'.format,
+        'lien': '**{0}** [{2}]({1})\n\n'.format,
+        'section': '**{0}**\n\n{1}\n\n'.format,
+        'liste': '**{0}**\n{2}\n'.format,
+        'element': '* {0}\n'.format,
+        'ligne_champ': '**{0}** {1}'.format,
+        'texte': '{0}\n\n'.format,
+        'saut': '  \n  ',
+        'separateur': ' | ',
+    },
+}
+
+
+def md_escape(text):
+    """
+    Echappe les caractères de mise en forme Markdown d'une valeur
+    """
+    return str(text).replace('\\', '\\\\').replace('*', '\\*').replace('_', '\\_')
+
+
+def render_blocks(blocks, fmt):
+    """
+    Rend les blocs d'un message
+    input :
+        blocks : liste de blocs (cf TEMPLATES)
+        fmt : 'html' ou 'markdown'
+    output :
+        message rendu
+    """
+    templates = TEMPLATES[fmt]
+    if fmt == 'markdown':
+        # Les libellés perdent leurs espaces de mise en page, les valeurs sont échappées
+        label, value = str.strip, lambda text: md_escape(text).strip()
+    else:
+        label = value = str
+    parts = []
+    for block in blocks:
+        kind = block[0]
+        if kind == 'liste':
+            items = ''.join(templates['element'](templates['saut'].join(value(line) for line in lines)) for lines in block[2])
+            parts.append(templates['liste'](label(block[1]), templates['saut'] if block[3] else '', items))
+        elif kind == 'ligne':
+            parts.append(templates['separateur'].join(templates['ligne_champ'](label(name), value(text)) for name, text in block[1]) + '\n\n')
+        elif kind in ('url', 'lien'):
+            parts.append(templates[kind](label(block[1]), *block[2:]))
+        elif kind in ('champ', 'section'):
+            parts.append(templates[kind](label(block[1]), value(block[2])))
+        else:
+            parts.append(templates[kind](value(block[1])))
+    return ''.join(parts)
+
+
+def render_message(blocks):
+    """
+    Message rendu dans les deux formats : {'html': ..., 'markdown': ...}
+    """
+    return {'html': render_blocks(blocks, 'html'), 'markdown': render_blocks(blocks, 'markdown')}
+
 
+def rendered(message, fmt):
+    """
+    Message dans le format demandé. Un message HTML seul (messages en attente des versions précédentes) 
+    est converti en Markdown avec markdownify.
+    """
+    if isinstance(message, dict):
+        return message[fmt]
+    if fmt == 'markdown':
+        return md(message).replace(':** *',":**\n*")
+    return message
+
+
+###
+# Moteur d'extraction des champs des "données" d'un avis
+###
+
+# Chemin commun des extensions eForms
+EFORMS_EXTENSION = ('ext:UBLExtensions', 'ext:UBLExtension', 'ext:ExtensionContent', 'efext:EformsExtension')
+AWARDING_CRITERION = ('cac:TenderingTerms', 'cac:AwardingTerms', 'cac:AwardingCriterion')
+
+# Préfixes communs, résolus une seule fois par avis ('@nom' fait référence à un autre préfixe)
+EXTRACTION_PREFIXES = {
+    'cn': ('EFORMS', 'ContractNotice'),
+    'cn_ext': ('@cn',) + EFORMS_EXTENSION,
+    'cn_lot': ('@cn', 'cac:ProcurementProjectLot'),
+    'can': ('EFORMS', 'ContractAwardNotice'),
+    'can_result': ('@can',) + EFORMS_EXTENSION + ('efac:NoticeResult',),
+    'can_lot': ('@can', 'cac:ProcurementProjectLot'),
+}
+
+# Champs par type d'avis (first_key, nature) : liste de chemins, le premier chemin présent l'emporte
+FNSIMPLE_APPEL_OFFRE_FIELDS = {
+    'date_reception_offres': [('FNSimple', 'initial', 'procedure', 'dateReceptionOffres')],
+    'duree_mois': [('FNSimple', 'natureMarche', 'dureeMois')],
+    'duree_mois_initial': [('FNSimple', 'initial', 'natureMarche', 'dureeMois')],
+    'valeur_haute': [('FNSimple', 'natureMarche', 'valeurEstimee', 'fourchette', 'valeurHaute'),
+                     ('FNSimple', 'initial', 'natureMarche', 'valeurEstimee', 'fourchette', 'valeurHaute')],
+}
+
+EXTRACTION_FIELDS = {
+    ('MAPA', 'ATTRIBUTION'): {
+        'avisinitial': [('MAPA', 'attribution', 'avisInitial', 'idWeb')],
+        'montant': [('MAPA', 'attribution', 'attribution', 'resultat', 'attribue', 'montant', 'valeur')],
+    },
+    ('MAPA', 'APPEL_OFFRE'): {
+        'date_reception_offres': [('MAPA', 'initial', 'delais', 'receptionOffres')],
+        'ref': [('MAPA', 'initial', 'renseignements', 'idMarche')],
+        'criteres': [('MAPA', 'initial', 'criteres', 'criterePondere')],
+    },
+    ('MAPA', 'RECTIFICATIF'): {
+        'rubrique': [('MAPA', 'rectificatif', 'infosRectif', 'rubrique')],
+        'supprimer': [('MAPA', 'rectificatif', 'infosRectif', 'supprimer')],
+        'avisinitial': [('MAPA', 'rectificatif', 'avisInitial', 'idWeb')],
+    },
+    ('FNSimple', 'APPEL_OFFRE'): FNSIMPLE_APPEL_OFFRE_FIELDS,
+    ('FNSimple', 'ANNULATION'): FNSIMPLE_APPEL_OFFRE_FIELDS,
+    ('FNSimple', 'ATTRIBUTION'): {
+        'avisinitial': [('FNSimple', 'attribution', 'avisInitial', 'idWeb')],
+        'complement': [('FNSimple', 'attribution', 'attributionMarche')],
+    },
+    ('FNSimple', 'RECTIFICATIF'): {
+        'avisinitial': [('FNSimple', 'rectificatif', 'avisInitial', 'idWeb')],
+    },
+    ('EFORMS', 'APPEL_OFFRE'): {
+        'organisations': [('@cn_ext', 'efac:Organizations', 'efac:Organization')],
+        'lots': [('@cn_lot',)],
+        'criteres': [('@cn_lot',) + AWARDING_CRITERION + ('cac:SubordinateAwardingCriterion',)],
+        'criteres_description': [('@cn_lot',) + AWARDING_CRITERION + ('cbc:Description', '#text')],
+        'montant_estime': [('@cn', 'cac:ProcurementProject', 'cac:RequestedTenderTotal', 'cbc:EstimatedOverallContractAmount', '#text')],
+        'montant_estime_lot': [('@cn_lot', 'cac:ProcurementProject', 'cac:RequestedTenderTotal', 'cbc:EstimatedOverallContractAmount', '#text')],
+        'duree': [('@cn_lot', 'cac:ProcurementProject', 'cac:PlannedPeriod', 'cbc:DurationMeasure', '#text')],
+        'duree_unite': [('@cn_lot', 'cac:ProcurementProject', 'cac:PlannedPeriod', 'cbc:DurationMeasure', '@unitCode')],
+        'duree_renouvellement': [('@cn_lot', 'cac:ProcurementProject', 'cac:ContractExtension', 'cac:Renewal', 'cac:Period', 'cbc:Description', '#text')],
+    },
+    ('EFORMS', 'ATTRIBUTION'): {
+        'lots': [('@can_result', 'efac:LotResult')],
+        'offres': [('@can_result', 'efac:LotTender')],
+        'contrats': [('@can_result', 'efac:SettledContract')],
+        'titulaire': [('@can_result', 'efac:LotTender', 'efac:TenderReference', 'cbc:ID')],
+        'critere': [('@can_lot',) + AWARDING_CRITERION + ('cbc:CalculationExpression', '#text')],
+        'montant': [('@can_result', 'cbc:TotalAmount', '#text'),
+                    ('@can_result', 'efac:LotTender', 'cac:LegalMonetaryTotal', 'cbc:PayableAmount', '#text')],
+        'criteres': [('@can_lot',) + AWARDING_CRITERION + ('cac:SubordinateAwardingCriterion',)],
+        'criteres_description': [('@can_lot',) + AWARDING_CRITERION + ('cbc:Description', '#text')],
+        'soumissions': [('@can_result', 'efac:LotResult', 'efac:ReceivedSubmissionsStatistics', 0)],
+    },
+}
+
+# Champs relatifs à un élément (lot, critère, offre, ...) d'un avis
+EXTRACTION_ITEM_FIELDS = {
+    'critere': ('critere',),
+    'critere_pct': ('criterePCT',),
+    'critere_nom': ('cbc:AwardingCriterionTypeCode', '#text'),
+    'critere_valeur': EFORMS_EXTENSION + ('efac:AwardCriterionParameter', 'efbc:ParameterNumeric'),
+    'organisation_cpb': ('efbc:AwardingCPBIndicator',),
+    'organisation_nom': ('efac:Company', 'cac:PartyName', 'cbc:Name', '#text'),
+    'lot_criteres_description': AWARDING_CRITERION + ('cbc:Description', '#text'),
+    'lot_nom': ('cac:ProcurementProject', 'cbc:Name', '#text'),
+    'lot_description': ('cac:ProcurementProject', 'cbc:Description', '#text'),
+    'lot_montant_estime': ('cac:ProcurementProject', 'cac:RequestedTenderTotal', 'cbc:EstimatedOverallContractAmount', '#text'),
+    'lot_soumissions': ('efac:ReceivedSubmissionsStatistics', 0),
+    'offre_montant': ('cac:LegalMonetaryTotal', 'cbc:PayableAmount', '#text'),
+    'offre_titulaire': ('efac:TenderReference', 'cbc:ID'),
+    'contrat_titre': ('cbc:Title', '#text'),
+    'statistique_code': ('efbc:StatisticsCode', '@listName'),
+    'statistique_valeur': ('efbc:StatisticsNumeric',),
+}
+
+
+def compile_path(path):
+    """
+    Compile un chemin (tuple de clés et d'index) en fonction d'accès 
+    qui retourne None dès qu'un élément du chemin est absent
+    """
+    def accessor(node):
+        for key in path:
+            if isinstance(node, dict):
+                node = node.get(key)
+            elif isinstance(node, list) and isinstance(key, int) and -len(node) <= key < len(node):
+                node = node[key]
             else:
-                errmsg = "ERROR DONNEES : [" +ID + "]" + first_key + '(' + nature + ')'
-                print('(!) ' + errmsg)
-                toPushover(errmsg)
-            
-            #################
-                
-            ######
-            #
-            # GENERIQUE 
-            #
-            ######
-                
-            ## Titulaire
-            if not titulaire:
-                try:
-                    titulaires_list = record.get('titulaire',[])
-                    # Check if the list has only one entry or multiple entries
-                    if len(titulaires_list) == 1:
-                        # If there's only one entry, just take that entry
-                        titulaire = titulaires_list[0]
-                    else:
-                        # If there are multiple entries, join them with ', '
-                        titulaire = ', '.join(titulaires_list)
-                except:
-                    titulaire = ''
-            
-            if not date_reception_offres:
-                ## deadline 
-                date_reception_offres = record.get('datelimitereponse', 'Non disponible')
-                try:
-                    date_object = datetime.fromisoformat(date_reception_offres)
-                    date_reception_offres = date_object.strftime("%Y-%m-%d")
-                except:
-                    pass
-            
-            
-            if date_reception_offres:
-                target_date = datetime.strptime(date_reception_offres, "%Y-%m-%d")
-                current_date = datetime.now()
-                delai = (target_date - current_date).days
-    
+                return None
+            if node is None:
+                return None
+        return node
+    return accessor
 
-            # Create the message for msteams card 
-            message=''
-            if pubdate:
-                message+='<strong>' + pubdate + '</strong>\n\n'
-            message += '<strong>Acheteur : </strong>' + acheteur + '\n\n'
-            if ref:
-                message += '<strong>Référence marché : </strong>' + ref + '\n\n'
-            message += '<strong>Services : </strong>' + services_list + '\n\n'
-            if typemarche == "Marchés entre 90 k€ et seuils européens" and seuilmarches: 
-                typemarche = typemarche.replace('seuils européens',seuilmarches)
-            message += '<strong>Type de marché : </strong>' + typemarche + '\n\n' 
-            if montanttotal:
-                message += '<strong>Valeur maximale estimée du marché : </strong>' + format_large_number(str(montanttotal)) + '€\n\n' 
-            if montant: 
-                message += '<strong>Valeur du marché : </strong>' + format_large_number(str(montant)) + '€\n\n' 
-            if reponses_soumises:
-                message += '<strong>Nombre de réponses soumises : </strong>' + str(reponses_soumises) + "\n\n"
-            if nblots > 1 :
-                message += '<strong>Lots : </strong>' + str(nblots) +'\n\n'
-            if reponses_soumises_list:
-                message += reponses_soumises_list
-            if critere_pondere:
-                message += critere_pondere
-            if date_reception_offres:
-                message += '<strong>Deadline : </strong>' + date_reception_offres + ' ('+ str(delai)+ ' jours)\n\n' 
-            if dureemarche:
-                message += '<strong>Durée du marché : </strong>' +  dureemarche.replace('YEAR','an') + '\n\n'
-            if critere:
-                message += "<strong>Critère d'attribution : </strong>" + critere + "\n\n"
-            if titulaire:
-                message += '<strong>Titulaire(s) : </strong>' + titulaire + '\n\n'
-            if titulaire_par_lot:
-                message += titulaire_par_lot
-            if complement:
-                message += complement.replace('\n','\n\n') + '\n\n'
-            if montant_par_lot:
-                message += montant_par_lot
-            if correctif:
-                message += '<strong>Modification(s) : </strong>\n\n' + correctif + "\n\n"
-            if descriptif_lots:
-                message += descriptif_lots
-            if avisinitial:
-                #annonce_lie_list = ', '.join(['<a href="https://www.boamp.fr/pages/avis/?q=idweb:' + item + '">' + item + '</a>' for item in annonce_lie])
-                annonce_lie_list = '<a href="https://www.boamp.fr/pages/avis/?q=idweb:' + avisinitial+ '">' + avisinitial + '</a>'
-                message += '<strong>Annonce(s) liée(s) : </strong>' + annonce_lie_list + '\n\n'
-            message += '<strong>Avis : </strong> ' + urlavis + '\n\n'
-            
-            # Ajout de l'icone en fonction du montant du marché 
-            logomontant = '❓'
-            if montanttotal and nature == "APPEL_OFFRE":
-                if typemarche == "Marchés européens" and float(montanttotal) < float(montant1)/2:
-                    logomontant = '❌'
-                elif float(montanttotal) > float(montant3):
-                    logomontant = '💰💰💰'
-                elif float(montanttotal) > float(montant2): 
-                    logomontant = '💰💰'
-                elif float(montanttotal) > float(montant1):
-                    logomontant = '💰'
-                elif float(montanttotal) > float(montant1)/2:
-                    logomontant ='💶'
-                elif "entre" in typemarche:
-                    logomontant= '❌'
-            #    # Disable since no flag in Windows emoji :(  
-            #    #elif typemarche == "Marchés européens":
-            #    #    logomontant += '🇪🇺'
-            elif "entre" in typemarche:
-                    logomontant= '❌'
-            elif "MAPA" in typemarche:
-                logomontant = "❌"
-            
-            # Ajout du logo en fonction des services du marché 
-            logoservices_list = []
-            if "maintenance" in services_list.lower():
-                logoservices_list.append("🧰")
-            if "logiciel" in services_list.lower() or "progiciel" in services_list.lower():
-                logoservices_list.append("💿")
-            if "prestations" in services_list.lower() or "assistance" in services_list.lower():
-                logoservices_list.append("👥")
-            if "matériel" in services_list.lower():
-                logoservices_list.append("💻")
-            if "imprimerie" in services_list.lower():
-                logoservices_list.append("🖨️")
-            if "internet" in services_list.lower():
-                logoservices_list.append("🌍")
-            if "assistance" in services_list.lower():
-                logoservices_list.append("🆘")
-            if "consommable" in services_list.lower():
-                logoservices_list.append("♻️")
-            if "téléphonie" in services_list.lower() or "télécommunications" in services_list.lower():
-                logoservices_list.append('📞')
-            ## Affiche le logo du montant uniquement pour les avis de marchés / modification 
-            if nature == "APPEL_OFFRE":
-                if logomontant and logoservices_list:
-                    logoservice = " ".join(logoservices_list)
-                    logostring = '  (' + logomontant + ' | ' + logoservice +') '
-                elif logomontant and not logoservices_list:
-                    logostring = '  (' + logomontant  +') '
-                elif not logomontant and logoservices_list:
-                    logoservice = " ".join(logoservices_list)
-                    logostring = '  (' + logoservice + ') '
+
+def compile_rooted_path(path):
+    """
+    Compile un chemin pouvant commencer par un préfixe '@nom'
+    output :
+        tuple (nom du préfixe ou None, fonction d'accès)
+    """
+    if path and isinstance(path[0], str) and path[0].startswith('@'):
+        return path[0][1:], compile_path(path[1:])
+    return None, compile_path(path)
+
+
+COMPILED_PREFIXES = {name: compile_rooted_path(path) for name, path in EXTRACTION_PREFIXES.items()}
+COMPILED_FIELDS = {
+    key: {name: [compile_rooted_path(path) for path in paths] for name, paths in fields.items()}
+    for key, fields in EXTRACTION_FIELDS.items()
+}
+ITEM = {name: compile_path(path) for name, path in EXTRACTION_ITEM_FIELDS.items()}
+
+
+def extract_fields(donnees, first_key, nature):
+    """
+    Extrait les champs déclarés dans EXTRACTION_FIELDS pour ce type d'avis. 
+    Les préfixes communs ne sont parcourus qu'une fois.
+    input :
+        donnees : données décodées de l'avis
+        first_key, nature : type d'avis
+    output :
+        dictionnaire {champ: valeur ou None}, None si le type d'avis est inconnu
+    """
+    compiled = COMPILED_FIELDS.get((first_key, nature))
+    if compiled is None:
+        return None
+    nodes = {}
+
+    def resolve(prefix):
+        if prefix is None:
+            return donnees
+        if prefix not in nodes:
+            parent, accessor = COMPILED_PREFIXES[prefix]
+            nodes[prefix] = accessor(resolve(parent))
+        return nodes[prefix]
+
+    fields = {}
+    for name, paths in compiled.items():
+        value = None
+        for prefix, accessor in paths:
+            value = accessor(resolve(prefix))
+            if value is not None:
+                break
+        fields[name] = value
+    return fields
+
+
+def iso_date(value):
+    """
+    Convertit une date ISO au format yyyy-mm-dd ('' si la date est invalide)
+    """
+    if not isinstance(value, str):
+        return ''
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d")
+    except ValueError:
+        return ''
+
+
+def count_lots(lots):
+    """
+    Nombre de lots identifiés (cbc:ID) : un lot unique est un dictionnaire, plusieurs lots une liste
+    """
+    if isinstance(lots, dict):
+        return 1 if 'cbc:ID' in lots else 0
+    if isinstance(lots, list):
+        return sum(1 for lot in lots if isinstance(lot, dict) and 'cbc:ID' in lot)
+    return 0
+
+
+def lots_block(title, items, nblots, render, saut=False):
+    """
+    Construit le bloc liste des nblots premiers éléments (cf TEMPLATES)
+    input :
+        title : libellé de la liste
+        items : liste des éléments (lots, offres, contrats, ...)
+        nblots : nombre de lots
+        render : fonction (index, élément) -> texte (ou tuple de lignes) de l'élément, '' pour l'ignorer, None si une valeur manque
+        saut : retour à la ligne entre le libellé et la liste
+    output :
+        bloc ('liste', ...), '' si une valeur manque
+    """
+    if not isinstance(items, list) or nblots < 1 or len(items) < nblots:
+        return ''
+    lines = []
+    for i in range(nblots):
+        line = render(i, items[i])
+        if line is None:
+            return ''
+        if line:
+            lines.append(line if isinstance(line, tuple) else (line,))
+    return ('liste', title, lines, saut)
+
+
+def lots_amounts(items, nblots, accessor):
+    """
+    Montant par lot et montant total
+    output :
+        tuple (bloc liste, total), ('', None) si un montant manque
+    """
+    total = 0
+    def render(i, item):
+        nonlocal total
+        valeur = accessor(item)
+        try:
+            total += float(valeur)
+        except (TypeError, ValueError):
+            return None
+        return " Lot n°" + str(i+1) + " : " + format_large_number(str(valeur)) + "€"
+    block = lots_block("Montant du marché :", items, nblots, render)
+    return (block, total) if block else ('', None)
+
+
+def eforms_criteria(criteres, description):
+    """
+    Critères pondérés d'un avis EFORMS, à défaut la description des critères
+    """
+    if isinstance(criteres, list):
+        lines = []
+        for item in criteres:
+            critere_nom = ITEM['critere_nom'](item)
+            critere_valeur = ITEM['critere_valeur'](item)
+            if not isinstance(critere_nom, str) or critere_valeur is None:
+                break
+            lines.append((translate(critere_nom) + str(critere_valeur) + "% ",))
+        else:
+            return ('liste', 'Critères : ', lines, False)
+    if isinstance(description, str):
+        return ('champ', 'Critères : ', description)
+    return ''
+
+
+def extract_details(donnees, first_key, nature, ID, acheteur):
+    """
+    Extrait les informations spécifiques au type d'avis (MAPA, FNSimple, EFORMS)
+    input :
+        donnees : données décodées de l'avis
+        first_key, nature : type d'avis
+        ID : identifiant de l'avis
+        acheteur : nom de l'acheteur
+    output :
+        dictionnaire des informations (chaînes vides si absentes), 
+        'erreur' est renseigné si le type d'avis est inconnu
+    """
+    details = {
+        'acheteur': acheteur,
+        'montanttotal': '',
+        'avisinitial': '',
+        'critere_pondere': '',
+        'ref': '',
+        'titulaire': '',
+        'date_reception_offres': '',
+        'dureemarche': '',
+        'complement': '',
+        'nblots': 0,
+        'correctif': '',
+        'montant_par_lot': '',
+        'descriptif_lots': '',
+        'critere': '',
+        'montant': '',
+        'reponses_soumises': '',
+        'reponses_soumises_list': '',
+        'titulaire_par_lot': '',
+        'erreur': '',
+    }
+    fields = extract_fields(donnees, first_key, nature)
+    if fields is None:
+        details['erreur'] = "ERROR DONNEES : [" +ID + "]" + first_key + '(' + nature + ')'
+        return details
+
+    for name in ('avisinitial', 'ref', 'titulaire', 'critere', 'montant', 'complement'):
+        if fields.get(name) is not None:
+            details[name] = fields[name]
+    if 'date_reception_offres' in fields:
+        details['date_reception_offres'] = iso_date(fields['date_reception_offres'])
+
+    #### 
+    ##
+    ## MAPA
+    ## 
+    ####
+    if first_key == "MAPA" and nature == "ATTRIBUTION":
+        details['montanttotal'] = details['montant']
+
+    elif first_key == "MAPA" and nature == "APPEL_OFFRE":
+        critere_pondere_list = fields['criteres']
+        if isinstance(critere_pondere_list, list):
+            lines = []
+            for item in critere_pondere_list:
+                critere, critere_pct = ITEM['critere'](item), ITEM['critere_pct'](item)
+                if critere is None or critere_pct is None:
+                    break
+                lines.append(("  " + str(critere) + " : " + str(critere_pct) + "%",))
             else:
-                logoservice = " ".join(logoservices_list)
-                logostring = ' (' + logoservice + ') '
-            ## Creation du titre 
-            title = '['+ID+'] ' + status + logostring + objet
-            
-            # Envoie dans msteams
-            if not debug_mode:
-                if ms_webhook_attribution: 
-                    tomsteeams(nature,title,message)
-                    cptmsteams+=1 
-                if mattermost_webhook_attribution:
-                    tomattermost(nature,title,message)
-                    cptmattermost+=1 
+                details['critere_pondere'] = ('liste', "Critères d'attribution :", lines, False)
+
+    elif first_key == "MAPA" and nature == "RECTIFICATIF":
+        print("🛠️ A FAIRE : " + first_key + " " + nature)    
+        if fields['rubrique']:
+            details['correctif'] = fields['rubrique']
+            if fields['supprimer']:
+                details['correctif'] += " : " + fields['supprimer']
+
+    #### 
+    ##
+    ## FNSimple
+    ## 
+    ####
+    elif first_key == "FNSimple" and (nature == "APPEL_OFFRE" or nature == "ANNULATION"):
+        if fields['duree_mois'] is not None:
+            details['dureemarche'] = fields['duree_mois']
+        elif fields['duree_mois_initial'] is not None:
+            details['dureemarche'] = str(fields['duree_mois_initial']) + ' mois'
+        details['montanttotal'] = fields['valeur_haute'] if fields['valeur_haute'] is not None else ''
+
+    elif first_key == "FNSimple" and nature in ("ATTRIBUTION", "RECTIFICATIF"):
+        print("🛠️ [" + ID + "] A FINIR : " + first_key + " " + nature)
+
+    #### 
+    ##
+    ## EFORMS AVIS DE MARCHE 
+    ## 
+    ####
+    elif first_key == "EFORMS" and nature == "APPEL_OFFRE":
+        print("🛠️ [" + ID + "] A FINIR : " + first_key + " " + nature)
+        organisations = fields['organisations'] if isinstance(fields['organisations'], list) else []
+        for org in organisations:
+            if ITEM['organisation_cpb'](org) == "true" and ITEM['organisation_nom'](org) is not None:
+                acheteur = ITEM['organisation_nom'](org)
+        if "Tribunal" in acheteur: 
+            for org in organisations:
+                company_name = ITEM['organisation_nom'](org)
+                if isinstance(company_name, str) and "Tribunal" not in company_name:
+                    acheteur = company_name
+        details['acheteur'] = acheteur
+
+        lots = fields['lots']
+        nblots = count_lots(lots)
+        details['nblots'] = nblots
+        if nblots == 1:
+            details['critere_pondere'] = eforms_criteria(fields['criteres'], fields['criteres_description'])
+            if fields['montant_estime'] is not None:
+                details['montanttotal'] = fields['montant_estime']
+            elif fields['montant_estime_lot'] is not None:
+                details['montanttotal'] = fields['montant_estime_lot']
+
+        if nblots > 1:
+            def render_criteria(i, lot):
+                criteres_description = ITEM['lot_criteres_description'](lot)
+                if criteres_description is None:
+                    return None
+                lot_nom = ITEM['lot_nom'](lot)
+                if isinstance(lot_nom, str):
+                    return (" Lot n°" + str(i+1) + " : " + lot_nom, str(criteres_description))
+                return " Lot n°" + str(i+1) + " : " + str(criteres_description)
+            details['critere_pondere'] = lots_block("Critères d'attribution :", lots, nblots, render_criteria)
+
+        if fields['duree'] is not None and isinstance(fields['duree_unite'], str):
+            details['dureemarche'] = str(fields['duree']) + ' ' + translate(fields['duree_unite'])
+        elif fields['duree_renouvellement'] is not None:
+            details['dureemarche'] = fields['duree_renouvellement']
+
+        if not details['montanttotal']:
+            if fields['montant_estime'] is not None:
+                details['montanttotal'] = fields['montant_estime']
             else:
-                print(title + '\n' + remove_html_tags(message.replace('\n\n','\n')))
-                print('-----------------------------------------------')
+                montant_par_lot, montanttotal = lots_amounts(lots, nblots, ITEM['lot_montant_estime'])
+                if montant_par_lot:
+                    details['montant_par_lot'] = montant_par_lot
+                    details['montanttotal'] = montanttotal
+
+        def render_description(i, lot):
+            descriptif_lot = ITEM['lot_description'](lot)
+            if not isinstance(descriptif_lot, str):
+                return None
+            return " Lot n°" + str(i+1) + " : " + descriptif_lot
+        details['descriptif_lots'] = lots_block('Description des lots :', lots, nblots, render_description, saut=True)
+
+    #### 
+    ##
+    ## EFORMS ATTRIBUTION
+    ## 
+    ####
+    elif first_key == "EFORMS" and nature == "ATTRIBUTION":
+        nblots = count_lots(fields['lots'])
+        details['nblots'] = nblots
+        details['critere_pondere'] = eforms_criteria(fields['criteres'], fields['criteres_description'])
+        if nblots > 1:
+            def render_submissions(i, lot):
+                statistique = ITEM['lot_soumissions'](lot)
+                code = ITEM['statistique_code'](statistique)
+                if code is None:
+                    return None
+                if code != 'received-submission-type':
+                    return ''
+                valeur = ITEM['statistique_valeur'](statistique)
+                if valeur is None:
+                    return None
+                return " Lot n°" + str(i+1) + " : " + str(valeur)
+            details['reponses_soumises_list'] = lots_block("Réponses reçues par lots : ", fields['lots'], nblots, render_submissions)
+
+            montant_par_lot, montant = lots_amounts(fields['offres'], nblots, ITEM['offre_montant'])
+            if montant_par_lot:
+                details['montant_par_lot'] = montant_par_lot
+                details['montant'] = montant
+
+            def render_tenderer(i, offre):
+                titulaire_nom = ITEM['offre_titulaire'](offre)
+                if not isinstance(titulaire_nom, str):
+                    return None
+                return " Lot n°" + str(i+1) + " : " + titulaire_nom
+            details['titulaire_par_lot'] = lots_block("Titulaire par lot :", fields['offres'], nblots, render_tenderer)
+
+            def render_contract(i, contrat):
+                descriptif_lot = ITEM['contrat_titre'](contrat)
+                if not isinstance(descriptif_lot, str):
+                    return None
+                if "Lot n" in descriptif_lot:
+                    return descriptif_lot
+                return " Lot n°" + str(i+1) + " : " + descriptif_lot
+            details['descriptif_lots'] = lots_block("Descriptif des lots :", fields['contrats'], nblots, render_contract)
+
+        statistique = fields['soumissions']
+        if ITEM['statistique_code'](statistique) == 'received-submission-type' and ITEM['statistique_valeur'](statistique) is not None:
+            details['reponses_soumises'] = ITEM['statistique_valeur'](statistique)
+
+    return details
+
+
+# Logos des services : (logo, mots recherchés dans les libellés des descripteurs, légende)
+# dans l'ordre d'affichage, remplaçables par la clef "services" du fichier LOGOS
+SERVICE_LOGOS = (
+    ("🧰", ("maintenance",), "Marché identifié comme un marché de <strong>maintenance</strong>"),
+    ("💿", ("logiciel", "progiciel"), "Marché identifié comme un marché <strong>logiciel</strong>"),
+    ("👥", ("prestations", "assistance"), "Marché identifié comme un marché de <strong>prestation de service</strong>"),
+    ("💻", ("matériel",), "Marché identifié comme un marché de <strong>matériel</strong>"),
+    ("🖨️", ("imprimerie",), "Marché identifié comme un marché de <strong>matériel d'impression</strong>"),
+    ("🌍", ("internet",), None),
+    ("🆘", ("assistance",), "Marché identifié comme un marché de <strong>d'assistance</strong>"),
+    ("♻️", ("consommable",), None),
+    ("📞", ("téléphonie", "télécommunications"), "Marché identifié comme un marché de <strong>télécommunication</strong>"),
+)
+
+
+def load_logos(path):
+    """
+    Lit les règles de logos (cf logos.json.sample)
+    input :
+        path : fichier JSON {'services': [{'logo', 'mots', 'legende'}], 'montants': [{'seuil', 'logo'}]}
+    output :
+        dictionnaire des règles, None en cas d'erreur
+    """
+    try:
+        with open(path, 'rb') as file:
+            config = json_loads(file.read())
+        for rule in config.get('services', []):
+            if not (rule['logo'] and rule['mots']):
+                raise ValueError('règle de service sans logo ou sans mots')
+        for tier in config.get('montants', []):
+            float(tier['seuil'])
+            if not tier['logo']:
+                raise ValueError('tranche de montant sans logo')
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        errlog("Erreur de lecture des logos " + path + " : " + str(e))
+        return None
+    return config
+
+
+def compile_logos(config=None):
+    """
+    Compile les règles de logos une fois pour toutes : mots des services en minuscules 
+    et seuils de montant convertis et triés
+    input :
+        config : règles lues par load_logos, par défaut SERVICE_LOGOS et les seuils MONTANT1/2/3
+    output :
+        dictionnaire {'matchers', 'services', 'thresholds', 'tiers'}
+    """
+    config = config or {}
+    if 'services' in config:
+        services = tuple((rule['logo'], tuple(rule['mots']), rule.get('legende')) for rule in config['services'])
+    else:
+        services = SERVICE_LOGOS
+    if 'montants' in config:
+        tiers = [(float(tier['seuil']), tier['logo']) for tier in config['montants']]
+    else:
+        tiers = [(float(montant1) / 2, '💶'), (float(montant1), '💰'), (float(montant2), '💰💰'), (float(montant3), '💰💰💰')]
+    tiers.sort()
+    return {
+        'matchers': tuple((logo, tuple(word.lower() for word in keywords)) for logo, keywords, legend in services),
+        'services': services,
+        'thresholds': [threshold for threshold, logo in tiers],
+        'tiers': [logo for threshold, logo in tiers],
+    }
+
+
+def classify_services(services_list, classifier):
+    """
+    Logos des services identifiés dans services_list (mis en minuscules une seule fois)
+    """
+    text = services_list.lower()
+    logos = []
+    # Recherche de sous-chaînes plutôt qu'une expression régulière combinée : plus rapide sur des libellés courts
+    for logo, words in classifier['matchers']:
+        for word in words:
+            if word in text:
+                logos.append(logo)
+                break
+    return logos
+
+
+def amount_logo(nature, typemarche, montanttotal, classifier):
+    """
+    Logo de la tranche de montant d'un avis (seuils pré-calculés, cf compile_logos)
+    """
+    if montanttotal and nature == "APPEL_OFFRE":
+        amount = float(montanttotal)
+        thresholds = classifier['thresholds']
+        # Marché européen sous la plus petite tranche
+        if typemarche == "Marchés européens" and thresholds and amount < thresholds[0]:
+            return '❌'
+        # Plus haute tranche strictement dépassée
+        tier = bisect.bisect_left(thresholds, amount)
+        if tier:
+            return classifier['tiers'][tier - 1]
+        if "entre" in typemarche:
+            return '❌'
+    #    # Disable since no flag in Windows emoji :(  
+    #    #elif typemarche == "Marchés européens":
+    #    #    logomontant += '🇪🇺'
+    elif "entre" in typemarche:
+        return '❌'
+    elif "MAPA" in typemarche:
+        return "❌"
+    return '❓'
+
+
+def top_tier(nature, montanttotal, classifier):
+    """
+    Avis de marché dont le montant dépasse la plus haute tranche (💰💰💰 par défaut, cf compile_logos)
+    """
+    thresholds = classifier['thresholds']
+    return bool(montanttotal and thresholds) and nature == "APPEL_OFFRE" and float(montanttotal) > thresholds[-1]
+
+
+def notice_logos(nature, typemarche, montanttotal, services_list, config):
+    """
+    Logos du titre d'un avis : tranche de montant (avis de marché) et services identifiés
+    input :
+        nature, typemarche, montanttotal, services_list : informations de l'avis
+        config : configuration du rendu (cf render_config)
+    output :
+        chaîne des logos insérée dans le titre
+    """
+    # Ajout de l'icone en fonction du montant du marché 
+    logomontant = amount_logo(nature, typemarche, montanttotal, config['logos'])
+
+    # Ajout du logo en fonction des services du marché 
+    logoservices_list = classify_services(services_list, config['logos'])
+    ## Affiche le logo du montant uniquement pour les avis de marchés / modification 
+    if nature == "APPEL_OFFRE":
+        if logomontant and logoservices_list:
+            logoservice = " ".join(logoservices_list)
+            logostring = '  (' + logomontant + ' | ' + logoservice +') '
+        elif logomontant and not logoservices_list:
+            logostring = '  (' + logomontant  +') '
+        elif not logomontant and logoservices_list:
+            logoservice = " ".join(logoservices_list)
+            logostring = '  (' + logoservice + ') '
+    else:
+        logoservice = " ".join(logoservices_list)
+        logostring = ' (' + logoservice + ') '
+    return logostring
+
+
+def build_notice(record, config):
+    """
+    Extrait les informations d'un avis et construit le titre et le message (HTML).
+    Fonction pure (sans compteur ni envoi) pour pouvoir être exécutée dans un autre processus.
+    input :
+        record : enregistrement brut de l'API BOAMP
+        config : configuration du rendu (cf render_config)
+    output :
+        dictionnaire de l'avis structuré (dont 'title' et 'message')
+    """
+    nature = record.get('nature')
+    status = STATUS_LOGOS.get(nature, "")
+    ID = record.get('idweb', 'Non disponible')
+    acheteur = record.get('nomacheteur', 'Non disponible')
+    objet = record.get('objet', 'Non disponible')
+    # Sans descripteur possible lorsque les listes de surveillance imposent une récupération large
+    services = record.get('descripteur_libelle') or []
+    services_clean = ', '.join(services)
+    services_list= services_clean.replace('Informatique (','').replace(')','')
+    pubdate =  record.get('dateparution', 'Non disponible')
+    typemarche = record.get('famille_libelle', 'Non disponible')
+    urlavis = record.get('url_avis', 'Not available')
+    descripteurs = list(zip(record.get('descripteur_code') or [], services))
+    departements = [str(code) for code in record.get('code_departement') or []]
+    ###
+    # Lecture des "données"  
+    ###
+    donnees_brut = record.get('donnees',{})
+    started = time.perf_counter()
+    donnees = json_loads(donnees_brut)
+    decoded = time.perf_counter()
+    first_key = next(iter(donnees))
+
+    details = extract_details(donnees, first_key, nature, ID, acheteur)
+    extracted = time.perf_counter()
+    acheteur = details['acheteur']
+    montanttotal = details['montanttotal']
+    avisinitial = details['avisinitial']
+    critere_pondere = details['critere_pondere']
+    ref = details['ref']
+    titulaire = details['titulaire']
+    date_reception_offres = details['date_reception_offres']
+    dureemarche = details['dureemarche']
+    complement = details['complement']
+    nblots = details['nblots']
+    correctif = details['correctif']
+    montant_par_lot = details['montant_par_lot']
+    descriptif_lots = details['descriptif_lots']
+    critere = details['critere']
+    montant = details['montant']
+    reponses_soumises = details['reponses_soumises']
+    reponses_soumises_list = details['reponses_soumises_list']
+    titulaire_par_lot = details['titulaire_par_lot']
+
+    #################
+
+    ######
+    #
+    # GENERIQUE 
+    #
+    ######
+
+    ## Titulaire
+    if not titulaire:
+        try:
+            titulaires_list = record.get('titulaire',[])
+            # Check if the list has only one entry or multiple entries
+            if len(titulaires_list) == 1:
+                # If there's only one entry, just take that entry
+                titulaire = titulaires_list[0]
+            else:
+                # If there are multiple entries, join them with ', '
+                titulaire = ', '.join(titulaires_list)
+        except:
+            titulaire = ''
+
+    if not date_reception_offres:
+        ## deadline 
+        date_reception_offres = record.get('datelimitereponse', 'Non disponible')
+        try:
+            date_object = datetime.fromisoformat(date_reception_offres)
+            date_reception_offres = date_object.strftime("%Y-%m-%d")
+        except:
+            pass
+
+
+    if date_reception_offres:
+        target_date = datetime.strptime(date_reception_offres, "%Y-%m-%d")
+        current_date = datetime.now()
+        delai = (target_date - current_date).days
+
+
+    # Description structurée du message, rendue en HTML (msteams) et en Markdown (mattermost)
+    blocks = []
+    if pubdate:
+        blocks.append(('gras', pubdate))
+    blocks.append(('champ', 'Acheteur : ', acheteur))
+    if ref:
+        blocks.append(('champ', 'Référence marché : ', ref))
+    blocks.append(('champ', 'Services : ', services_list))
+    if typemarche == "Marchés entre 90 k€ et seuils européens" and config['seuilmarches']: 
+        typemarche = typemarche.replace('seuils européens',config['seuilmarches'])
+    blocks.append(('champ', 'Type de marché : ', typemarche))
+    if montanttotal:
+        blocks.append(('champ', 'Valeur maximale estimée du marché : ', format_large_number(str(montanttotal)) + '€'))
+    if montant: 
+        blocks.append(('champ', 'Valeur du marché : ', format_large_number(str(montant)) + '€'))
+    if reponses_soumises:
+        blocks.append(('champ', 'Nombre de réponses soumises : ', str(reponses_soumises)))
+    if nblots > 1 :
+        blocks.append(('champ', 'Lots : ', str(nblots)))
+    if reponses_soumises_list:
+        blocks.append(reponses_soumises_list)
+    if critere_pondere:
+        blocks.append(critere_pondere)
+    if date_reception_offres:
+        blocks.append(('champ', 'Deadline : ', date_reception_offres + ' ('+ str(delai)+ ' jours)'))
+    if dureemarche:
+        blocks.append(('champ', 'Durée du marché : ', dureemarche.replace('YEAR','an')))
+    if critere:
+        blocks.append(('champ', "Critère d'attribution : ", critere))
+    if titulaire:
+        blocks.append(('champ', 'Titulaire(s) : ', titulaire))
+    if titulaire_par_lot:
+        blocks.append(titulaire_par_lot)
+    if complement:
+        blocks.append(('texte', complement.replace('\n','\n\n')))
+    if montant_par_lot:
+        blocks.append(montant_par_lot)
+    if correctif:
+        blocks.append(('section', 'Modification(s) : ', correctif))
+    if descriptif_lots:
+        blocks.append(descriptif_lots)
+    if avisinitial:
+        blocks.append(('lien', 'Annonce(s) liée(s) : ', 'https://www.boamp.fr/pages/avis/?q=idweb:' + avisinitial, avisinitial))
+    blocks.append(('url', 'Avis : ', urlavis))
+    message = render_message(blocks)
+
+    logostring = notice_logos(nature, typemarche, montanttotal, services_list, config)
+    ## Creation du titre 
+    title = '['+ID+'] ' + status + logostring + objet
+
+    return {
+        'idweb': ID,
+        'nature': nature,
+        'pubdate': pubdate,
+        'acheteur': acheteur,
+        'objet': objet,
+        'services': services_list,
+        'typemarche': typemarche,
+        'montanttotal': montanttotal,
+        'montant': montant,
+        'date_reception_offres': date_reception_offres,
+        'avisinitial': avisinitial,
+        'titulaire': titulaire,
+        'nblots': nblots,
+        'descripteurs': descripteurs,
+        'departements': departements,
+        'url': urlavis,
+        'title': title,
+        'message': message,
+        # Avis envoyé individuellement en tête des synthèses (DIGEST_PRIORITE)
+        'priorite': top_tier(nature, montanttotal, config['logos']),
+        'erreur': details['erreur'],
+        # Temps par étape, remontés au processus principal (cf record_time)
+        'timings': {
+            'decodage_json': decoded - started,
+            'extraction_' + first_key: extracted - decoded,
+            'rendu': time.perf_counter() - extracted,
+        },
+    }
+
+
+# Synthèse (DIGEST) : libellé par nature d'avis
+DIGEST_LABELS = {
+    "APPEL_OFFRE": "avis de marché",
+    "RECTIFICATIF": "modification(s) d'avis de marché",
+    "ANNULATION": "annulation(s) d'avis de marché",
+    "ATTRIBUTION": "avis d'attribution",
+}
+
+def digest_entry(notice):
+    """
+    Résumé d'un avis dans un message de synthèse (rendu HTML et Markdown, cf render_message)
+    """
+    fields = [('Acheteur : ', notice['acheteur'])]
+    if notice['montanttotal']:
+        fields.append(('Valeur maximale estimée : ', format_large_number(str(notice['montanttotal'])) + '€'))
+    if notice['montant']:
+        fields.append(('Valeur : ', format_large_number(str(notice['montant'])) + '€'))
+    if notice['date_reception_offres'] and notice['nature'] == "APPEL_OFFRE":
+        fields.append(('Deadline : ', notice['date_reception_offres']))
+    return render_message([('gras', notice['title']), ('ligne', fields), ('url', 'Avis : ', notice['url'])])
+
+
+def build_digests(entries, date):
+    """
+    Regroupe les résumés des avis par channel et par nature en un minimum de messages de synthèse
+    de moins de DIGEST_TAILLE_MAX octets, sous les limites des cartes Teams (28 ko) et des posts Mattermost (16383 caractères).
+    input :
+        entries : liste de tuples (nature, targets, résumé) dans l'ordre des avis (cf digest_entry)
+        date : date des avis
+    output :
+        liste de tuples (pubdate, title, message, nature, targets) à envoyer
+    """
+    envois = []
+    groups = {}
+    for nature, targets, entry in entries:
+        for target in targets:
+            groups.setdefault((target, nature), []).append(entry)
+
+    for (target, nature), group in groups.items():
+        parts = []
+        current = []
+        size = 0
+        for entry in group:
+            entry_size = len(entry['html'].encode('utf-8'))
+            if current and size + entry_size > digest_taille_max:
+                parts.append(current)
+                current = []
+                size = 0
+            current.append(entry)
+            size += entry_size
+        parts.append(current)
+        for i, part in enumerate(parts, 1):
+            title = STATUS_LOGOS.get(nature, '') + ' Synthèse du ' + date + ' : ' + str(len(part)) + ' ' + DIGEST_LABELS.get(nature, 'avis')
+            if len(parts) > 1:
+                title += ' (' + str(i) + '/' + str(len(parts)) + ')'
+            message = {fmt: ''.join(entry[fmt] for entry in part) for fmt in TEMPLATES}
+            envois.append((date, title, message, nature, [target]))
+    if entries:
+        stdlog(str(len(entries)) + ' avis regroupé(s) en ' + str(len(envois)) + ' message(s)')
+    return envois
+
+
+def render_config():
+    """
+    Configuration du rendu transmise à build_notice
+    """
+    return {
+        'logos': logo_classifier or compile_logos(),
+        'seuilmarches': seuilmarches,
+    }
+
+
+def batched(iterable, size):
+    """
+    Découpe iterable en listes de size éléments
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def build_notices(records, total_count):
+    """
+    Construit les avis au fil de l'eau, dans un pool de processus pour les gros volumes
+    input :
+        records : itérable des enregistrements bruts de l'API BOAMP
+        total_count : nombre d'enregistrements attendus
+    output :
+        générateur des avis structurés dans l'ordre des enregistrements
+    """
+    config = render_config()
+    if parse_workers > 1 and total_count >= parse_process_seuil:
+        dbglog('Analyse de ' + str(total_count) + ' avis sur ' + str(parse_workers) + ' processus')
+        with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+            # Envoi par lots pour ne garder en mémoire qu'un nombre borné d'enregistrements
+            for batch in batched(records, PARSE_BATCH_SIZE):
+                chunksize = max(1, len(batch) // (parse_workers * 4))
+                yield from executor.map(partial(build_notice, config=config), batch, chunksize=chunksize)
     else:
-        errlog("Pas de résultat trouvé")
+        for record in records:
+            yield build_notice(record, config)
+
+
+def parse_boamp_data(snapshot, date, sinks=None):
+    """
+    Parses the BOAMP notices of a snapshot and extracts key information.
+    :param snapshot: Snapshot written by fetch_boamp_data ({'total_count': ..., 'files': [...]}).
+    :param date: Date string of the snapshot.
+    :param sinks: Delivery sinks (see SINKS), defaults to the configured webhooks.
+    Notices are delivered, indexed and stored every PAGE_SIZE notices.
+    :return: Number of messages sent per sink.
+    """
+    total_count = snapshot.get('total_count', 0)
+    if total_count == 0:
+        stdlog('Pas de nouvel avis pour ' + date)
+        return {}
+      
+    stdlog(str(total_count) + ' enregistrement(s) récupéré(s)')
+
+    # Le mode --replay (sinks imposés) envoie tous les avis retenus vers ses propres canaux
+    replay_sinks = sinks is not None
+    routing = None
+    classifier = logo_classifier or compile_logos()
+    if sinks is None:
+        routing = routes or compile_routes(default_routes())
+        sinks = routing['sinks']
+
+    stdlog('Extraction des données ...')
+    new_seen = []
+    skipped = 0
+    filtered = 0
+    matches = {}
+
+    def unseen_records():
+        nonlocal skipped, filtered
+        for record in iter_snapshot_records(snapshot['files']):
+            ## Avis hors DESCRIPTEURS et hors listes de surveillance (récupération large) : ignoré
+            if watchlists is not None:
+                default, names = match_record(record)
+                if not default and not names:
+                    filtered += 1
+                    continue
+            ## Avis déjà traité et inchangé : ignoré avant toute analyse
+            if seen_index is not None:
+                digest = notice_hash(record)
+                known_digest = seen_index.get(record.get('idweb'))
+                if known_digest == digest and not force_mode:
+                    skipped += 1
+                    continue
+                if known_digest:
+                    dbglog('[' + str(record.get('idweb')) + '] Avis modifié depuis le dernier traitement')
+                new_seen.append((record.get('idweb'), digest, record.get('dateparution')))
+            if watchlists is not None:
+                matches[record.get('idweb', 'Non disponible')] = (default, names)
+            yield record
+
+    sent = {}
+    envois = []
+    stored = []
+    pending = 0
+    digest_entries = []
+    # Avis du lot dont seul le résumé est conservé, et leurs entrées de l'index en attente des synthèses
+    held = []
+    held_seen = []
+
+    def flush(final=False):
+        # Envoi, index et base des avis par lot : la mémoire reste bornée quel que soit le nombre d'avis du jour
+        nonlocal envois, stored, pending, held
+        batch_sent, failed = deliver(envois)
+        for sink, sink_sent in batch_sent.items():
+            sent[sink] = sent.get(sink, 0) + sink_sent
+        spool_dead_letters(failed)
+        if seen_index is not None and pending:
+            # Un avis d'une synthèse n'est marqué traité qu'une fois la synthèse envoyée ou mise en attente
+            entries = new_seen[:pending]
+            del new_seen[:pending]
+            held_seen.extend(entry for entry, digest in zip(entries, held) if digest)
+            entries = [entry for entry, digest in zip(entries, held) if not digest]
+            if final:
+                entries += held_seen
+            if entries:
+                mark_seen(seen_db, seen_index, entries)
+        elif final and held_seen:
+            mark_seen(seen_db, seen_index, held_seen)
+        if stored:
+            store_notices(notice_db, stored)
+        envois, stored, pending, held = [], [], 0, []
+
+    for notice in build_notices(unseen_records(), total_count):
+        default, names = matches.pop(notice['idweb'], (True, ()))
+        # Destinataires évalués une seule fois par avis : table de routage et listes de surveillance
+        if replay_sinks:
+            notice['targets'] = sink_targets(notice['nature'], sinks)
+        else:
+            notice['targets'] = (route_notice(notice, routing, classifier) if default else []) + \
+                                [target for name in sorted(names) for target in watchlists['targets'][name]]
+        for name in names:
+            count('listes', name)
+        for stage, seconds in notice['timings'].items():
+            record_time(stage, seconds)
+        # Statistiques et base des avis : avis des DESCRIPTEURS uniquement, les autres sont comptés par liste de surveillance
+        if default:
+            determine_status(notice['nature'])
+            count_dimensions(date, notice)
+            if notice_db is not None:
+                stored.append(notice)
+        else:
+            count_watchlists(date, names)
+        if notice['erreur']:
+            print('(!) ' + notice['erreur'])
+            toPushover(notice['erreur'])
+        # Mise en file d'attente pour msteams et mattermost (seul le résumé est conservé pour la synthèse)
+        held.append(not debug_mode and digest_mode and not (digest_priorite and notice['priorite']))
+        if held[-1]:
+            digest_entries.append((notice['nature'], notice['targets'], digest_entry(notice)))
+        elif not debug_mode:
+            envois.append((notice['pubdate'], notice['title'], notice['message'], notice['nature'], notice['targets']))
+        else:
+            if names:
+                print('(listes : ' + ', '.join(sorted(names)) + ')')
+            print(notice['title'] + '\n' + remove_html_tags(notice['message']['html'].replace('\n\n','\n')))
+            print('-----------------------------------------------')
+        pending += 1
+        if pending == PAGE_SIZE:
+            flush()
+
+    if skipped:
+        stdlog(str(skipped) + ' avis déjà traité(s) ignoré(s)')
+    if filtered:
+        stdlog(str(filtered) + ' avis hors descripteurs et listes de surveillance ignoré(s)')
+
+    if digest_entries:
+        envois.extend(build_digests(digest_entries, date))
+    flush(final=True)
+    for sink in dict.fromkeys(sinks + list(sent)):
+        stdlog(str(sent.get(sink, 0)) + ' message(s) envoyé(s) dans ' + sink)
+    return sent
+
+
+def day_counters():
+    """
+    Retourne l'état des compteurs par nature d'avis (colonnes de la base des statistiques)
+    """
+    return {
+        "Marche": cptao,
+        "Modification": cptmodif,
+        "Notification": cptres,
+        "Autre": cptother
+    }
+
+
+def date_range(date_from, date_to):
+    """
+    Liste les dates du date_from au date_to inclus
+    input :
+        date_from, date_to : dates au format yyyy-mm-dd
+    output :
+        liste de dates au format yyyy-mm-dd
+    """
+    start = datetime.strptime(date_from, "%Y-%m-%d")
+    end = datetime.strptime(date_to, "%Y-%m-%d")
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+
+def amount_bucket(notice):
+    """
+    Tranche de montant d'un avis pour les statistiques (seuils MONTANT1/2/3)
+    """
+    amount = to_float(notice['montanttotal']) or to_float(notice['montant'])
+    if amount is None:
+        return 'inconnu'
+    for threshold, label in ((90000, '< 90k€'), 
+                             (float(montant1), '90k€ - ' + format_large_number(montant1) + '€'),
+                             (float(montant2), format_large_number(montant1) + '€ - ' + format_large_number(montant2) + '€'),
+                             (float(montant3), format_large_number(montant2) + '€ - ' + format_large_number(montant3) + '€')):
+        if amount < threshold:
+            return label
+    return '> ' + format_large_number(montant3) + '€'
+
+
+def count_dimensions(date, notice):
+    """
+    Compte un avis par descripteur, acheteur et tranche de montant pour les statistiques du jour date
+    """
+    counts = stats_dimensions.setdefault(date, {})
+    keys = [('descripteur', libelle) for code, libelle in notice['descripteurs']]
+    keys += [('acheteur', notice['acheteur']), ('montant', amount_bucket(notice))]
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+
 
-    stdlog(str(cptmsteams) + ' message(s) envoyé(s) dans msteams')
-    stdlog(str(cptmattermost) + ' message(s) envoyé(s) dans mattermost')
+def count_watchlists(date, names):
+    """
+    Compte un avis retenu par les seules listes de surveillance (dimension 'liste' des statistiques du jour date)
+    """
+    counts = stats_dimensions.setdefault(date, {})
+    for name in names:
+        counts[('liste', name)] = counts.get(('liste', name), 0) + 1
+
+
+def open_stats_store(path=STATS_FILE, legacy_path="statistiques.json"):
+    """
+    Ouvre la base des statistiques (une ligne par date, dimensions dans une table dédiée).
+    A la création, les statistiques de l'ancien fichier statistiques.json sont reprises 
+    (une seule fois : la version du schéma est ensuite notée dans PRAGMA user_version).
+    """
+    conn = sqlite3.connect(path)
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= STATS_SCHEMA_VERSION:
+        return conn
+    conn.execute("CREATE TABLE IF NOT EXISTS statistiques (date TEXT PRIMARY KEY, Marche INTEGER, Modification INTEGER, Notification INTEGER, Autre INTEGER)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS statistiques_dimensions (date TEXT NOT NULL, dimension TEXT NOT NULL, valeur TEXT NOT NULL, 
+        nombre INTEGER NOT NULL, PRIMARY KEY (date, dimension, valeur))""")
+    conn.execute("CREATE INDEX IF NOT EXISTS statistiques_dimensions_valeur ON statistiques_dimensions (dimension, valeur)")
+    if conn.execute("SELECT COUNT(*) FROM statistiques").fetchone()[0] == 0 and os.path.exists(legacy_path):
+        with open(legacy_path, "rb") as json_file:
+            legacy = json_loads(json_file.read()).get("statistiques", [])
+        conn.executemany("INSERT OR IGNORE INTO statistiques (date, Marche, Modification, Notification, Autre) VALUES (?, ?, ?, ?, ?)",
+                         [(entry["date"], entry.get("Marche", 0), entry.get("Modification", 0), entry.get("Notification", 0), entry.get("Autre", 0)) for entry in legacy])
+        stdlog(str(len(legacy)) + ' jour(s) repris de ' + legacy_path)
+    conn.execute("PRAGMA user_version = " + str(STATS_SCHEMA_VERSION))
+    conn.commit()
+    return conn
+
+
+def write_statistiques(entries, file_path=STATS_FILE):
+    """
+    Ajoute les statistiques journalières (et leurs dimensions) dans la base des statistiques : 
+    une insertion par date, les dates déjà présentes sont ignorées
+    input :
+        entries : liste de dictionnaires {date, Marche, Modification, Notification, Autre}
+        file_path : base des statistiques
+    """
+    conn = open_stats_store(file_path)
+    added = []
+    for entry in entries:
+        cursor = conn.execute("INSERT OR IGNORE INTO statistiques (date, Marche, Modification, Notification, Autre) VALUES (?, ?, ?, ?, ?)",
+                              (entry["date"], entry["Marche"], entry["Modification"], entry["Notification"], entry["Autre"]))
+        dimensions = stats_dimensions.pop(entry["date"], {})
+        if cursor.rowcount == 0:
+            stdlog("La date " + entry["date"] + " existe déjà. Les statistiques n\'ont pas été mises à jour")
+            continue
+        conn.executemany("INSERT INTO statistiques_dimensions (date, dimension, valeur, nombre) VALUES (?, ?, ?, ?)",
+                         [(entry["date"], dimension, valeur, nombre) for (dimension, valeur), nombre in dimensions.items()])
+        added.append(entry["date"])
+    conn.commit()
+    conn.close()
+    if added:
+        stdlog('Ecriture des statistiques pour ' + ', '.join(added))
+
+
+def run_daemon(interval, select_option=None, parallel=False):
+    """
+    Mode démon : interroge l'API toutes les interval minutes et n'envoie que les nouveaux avis.
+    La date de parution n'ayant qu'une précision au jour, le high-water mark est complété par le dernier idweb 
+    récupéré ce jour-là : chaque cycle ne demande à l'API que les avis qui le suivent. 
+    Au changement de jour, les jours depuis le high-water mark sont récupérés en entier (snapshots archivés), 
+    l'index des avis déjà traités écartant ceux qui ont déjà été envoyés.
+    input :
+        interval : minutes entre deux interrogations
+        select_option : 'attribution', 'ao' ou 'rectificatif'
+        parallel : récupère les pages en parallèle
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    high_water = read_state(seen_db, 'high_water', today)
+    high_water_idweb = read_state(seen_db, 'high_water_idweb')
+    last_housekeeping = today
+    housekeeping_thread = None
+    pending_stats = {}
+    stdlog('Démarrage du démon : interrogation toutes les ' + str(interval) + ' minute(s) depuis le ' + high_water + 
+           (' (après l\'avis ' + high_water_idweb + ')' if high_water_idweb else ''))
+
+    def process(date, day_data):
+        counters_before = day_counters()
+        parse_boamp_data(day_data, date)
+        counters_after = day_counters()
+        entry = pending_stats.setdefault(date, {"date": date})
+        for key in counters_after:
+            entry[key] = entry.get(key, 0) + counters_after[key] - counters_before[key]
+
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            today = datetime.now().strftime("%Y-%m-%d")
+            try:
+                if last_housekeeping != today and not (housekeeping_thread and housekeeping_thread.is_alive()):
+                    stdlog('🧹 Nettoyage')
+                    housekeeping_thread = start_housekeeping(day_before_gzip, day_before_delete)
+                    last_housekeeping = today
+
+                drain_dead_letters()
+                if high_water == today and high_water_idweb:
+                    # Même jour : seuls les avis suivant le dernier idweb récupéré
+                    spool = tempfile.mkdtemp(prefix='spool-', dir='data')
+                    try:
+                        data = fetch_boamp_data(today, select_option, parallel, directory=spool, after_idweb=high_water_idweb)
+                        if data and data['total_count']:
+                            process(today, data)
+                            high_water_idweb = last_idweb(data['files']) or high_water_idweb
+                        elif data is not None:
+                            dbglog('Pas de nouvel avis après ' + high_water_idweb)
+                    finally:
+                        shutil.rmtree(spool, ignore_errors=True)
+                else:
+                    # Nouveau jour (ou premier cycle) : jours complets depuis le high-water mark
+                    datas = fetch_boamp_days(date_range(high_water, today), select_option, parallel)
+                    for date, day_data in sorted(datas.items()):
+                        if day_data and day_data['total_count']:
+                            process(date, day_data)
+                    # En cas d'erreur, les mêmes jours sont repris au cycle suivant
+                    if all(day_data is not None for day_data in datas.values()):
+                        high_water = today
+                        high_water_idweb = last_idweb(datas[today]['files']) if datas[today]['total_count'] else None
+                write_state(seen_db, 'high_water', high_water)
+                write_state(seen_db, 'high_water_idweb', high_water_idweb)
+
+                # Statistiques des journées terminées
+                finished = sorted(date for date in pending_stats if date < today)
+                if finished and write_stats:
+                    write_statistiques([pending_stats[date] for date in finished])
+                for date in finished:
+                    del pending_stats[date]
+                    stats_dimensions.pop(date, None)
+                if metriques:
+                    write_metrics(metriques)
+            except Exception as e:
+                errmsg = "Erreur du démon : " + str(e)
+                errlog(errmsg)
+                toPushover(errmsg)
+
+            time.sleep(max(0, interval * 60 - (time.monotonic() - cycle_start)))
+    except KeyboardInterrupt:
+        stdlog('Arrêt du démon')
+
+
+# Configuration recopiée dans les processus du mode --replay
+REPLAY_SETTINGS = ('debug_mode', 'force_mode', 'seen_index', 'seen_db', 'notice_db', 'montant1', 'montant2', 'montant3', 
+                   'seuilmarches', 'logo_classifier', 'USER_KEY', 'API_KEY', 'parse_workers', 'parse_process_seuil', 'livraison_workers', 
+                   'livraison_concurrence', 'livraison_debit', 'digest_mode', 'digest_priorite', 'digest_taille_max', 'replay_sortie')
+
+
+def init_replay_worker(settings):
+    """
+    Initialise la configuration globale d'un processus du mode --replay
+    """
+    globals().update(settings)
+
+
+def replay_groups(paths):
+    """
+    Regroupe par date les fichiers de snapshots (pages d'un même jour dans l'ordre)
+    input :
+        paths : fichiers data/boamp-<date>[-p<page>].json[.gz|.zst]
+    output :
+        liste ordonnée de tuples (date, fichiers)
+    """
+    pattern = re.compile(r'boamp-(\d{4}-\d{2}-\d{2})(?:-p(\d+))?\.json')
+    groups = {}
+    for path in paths:
+        match = pattern.search(os.path.basename(path))
+        if match:
+            groups.setdefault(match.group(1), []).append((int(match.group(2) or 1), path))
+        else:
+            stdlog('Fichier ignoré : ' + path)
+    return [(date, [path for page, path in sorted(pages)]) for date, pages in sorted(groups.items())]
+
+
+def replay_day(date, files):
+    """
+    Rejoue le snapshot d'un jour vers la sortie locale
+    output :
+        tuple (date, nombre d'avis, nombre de messages, durée en secondes)
+    """
+    start = time.perf_counter()
+    total_count = snapshot_total_count(files[0])
+    sent = parse_boamp_data({'total_count': total_count, 'files': files}, date, ['replay'])
+    return date, total_count, sent.get('replay', 0), time.perf_counter() - start
+
+
+def run_replay(paths, workers):
+    """
+    Mode --replay : analyse et rend des snapshots archivés sans accès réseau, 
+    plusieurs jours en parallèle, et affiche le débit obtenu
+    input :
+        paths : fichiers à rejouer (par défaut tous les snapshots du manifeste)
+        workers : nombre de processus
+    """
+    if not paths:
+        with _manifest_lock:
+            paths = [path for (path,) in manifest_db().execute("SELECT path FROM snapshots WHERE state != 'expired' ORDER BY date")]
+    days = replay_groups(paths)
+    if not days:
+        stdlog('Aucun snapshot à rejouer')
+        return
+    stdlog('Rejeu de ' + str(len(days)) + ' jour(s) sur ' + str(workers) + ' processus vers ' + replay_sortie)
+    settings = {name: globals()[name] for name in REPLAY_SETTINGS}
+    # Pas de pool imbriqué dans les processus de rejeu
+    settings['parse_workers'] = 1
+    records = messages = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_replay_worker, initargs=(settings,)) as executor:
+        futures = [executor.submit(replay_day, date, files) for date, files in days]
+        for future in futures:
+            date, count, sent, duration = future.result()
+            stdlog(date + ' : ' + str(count) + ' avis en ' + f"{duration:.2f}" + 's')
+            records += count
+            messages += sent
+    elapsed = time.perf_counter() - start
+    stdlog('Rejeu terminé : ' + str(records) + ' avis, ' + str(messages) + ' message(s) en ' + f"{elapsed:.2f}" + 's')
+    stdlog('Débit : ' + f"{records / elapsed:.1f}" + ' avis/s, ' + f"{messages / elapsed:.1f}" + ' messages/s')
+
+
+@lru_cache(maxsize=None)
+def legend_message(year):
+    """
+    Légende rendue en HTML et en Markdown, construite une seule fois (les seuils ne changent pas en cours d'exécution)
+    input :
+        year : année du copyright
+    output :
+        dictionnaire {'html': ..., 'markdown': ...}
+    """
+    classifier = logo_classifier or compile_logos()
+    thresholds = classifier['thresholds']
+    rows = []
+    # Tranches de montant : la plus petite (💶) ne concerne que les marchés européens 
+    for threshold, logo in list(zip(thresholds, classifier['tiers']))[1:]:
+        rows.append((logo, 'Marché supérieur à ' +  format_large_number(str(threshold)) + '€'))
+    if len(thresholds) > 1:
+        rows.append((classifier['tiers'][0], 'Marché européen compris entre '+  format_large_number(str(thresholds[0])) +'€ et ' +  format_large_number(str(thresholds[1]))+'€'))
+    elif thresholds:
+        rows.append((classifier['tiers'][0], 'Marché supérieur à ' +  format_large_number(str(thresholds[0])) + '€'))
+    rows.append(('❌', 'Marché entre 90k€ et ' + seuilmarches))
+    rows.append(('❌', 'Marché inférieur à 90k€ (MAPA)'))
+    if thresholds:
+        rows.append(('❌', 'Marché européen inférieur à '+  format_large_number(str(thresholds[0])) +'€'))
+    rows.append(('❓', 'Marché d\'un montant inconnu'))
+    for logo, words, legend in classifier['services']:
+        if legend:
+            rows.append((logo, legend))
+    rows.append(('🟢', 'Avis de marché'))
+    rows.append(('🟠', 'Modification d\'un avis de marché'))
+    rows.append(('🛑', 'Annulation d\'un avis de marché'))
+    rows.append(('🏆', 'Avis d\'attribution'))
+    copyright = '(C) 2022-' + str(year) + ' Computacenter - Développé par Julien Mousqueton'
+    version = 'Version : ' + __version__
+
+    html = '<table border="0"><tr><th>Logo</th><th>Description</th></tr>'
+    html += ''.join('<tr><td>' + logo + '</td><td>' + text + '</td></tr>' for logo, text in rows) + '</table>'
+    html += '<BR><BR>' + copyright + ' <BR><BR>' + version
+    markdown = '| Logo | Description |\n| --- | --- |\n'
+    markdown += ''.join('| ' + logo + ' | ' + text.replace('<strong>', '**').replace('</strong>', '**') + ' |\n' for logo, text in rows)
+    markdown += '\n' + copyright + '\n\n' + version
+    return {'html': html, 'markdown': markdown}
 
 
 def showlegend(debug=False):
     ''' 
     affiche la legende 
     '''
-    message = '<table border="0"><tr><th>Logo</th><th>Description</th></tr>'
-    message += '<tr><td>💰</td><td>Marché supérieur à ' +  format_large_number(str(montant1)) + '€</td></tr>'
-    message += '<tr><td>💰💰</td><td>Marché supérieur à ' +  format_large_number(str(montant2)) + '€</td></tr>'
-    message += '<tr><td>💰💰💰</td><td>Marché supérieur à ' +  format_large_number(str(montant3)) + '€</td></tr>'
-    message += '<tr><td>💶</td><td>Marché européen compris entre '+  format_large_number(str(float(montant1)/2)) +'€ et ' +  format_large_number(str(montant1))+'€</td></tr>'
-    message += '<tr><td>❌</td><td>Marché entre 90k€ et ' + seuilmarches + '</td></tr>'
-    message += '<tr><td>❌</td><td>Marché inférieur à 90k€ (MAPA)</td></tr>'
-    message += '<tr><td>❌</td><td>Marché européen inférieur à '+  format_large_number(str(float(montant1)/2)) +'€</td></tr>'
-    message += '<tr><td>❓</td><td>Marché d\'un montant inconnu</td></tr>' #  ou compris entre ' + seuilmarches +  ' et ' + format_large_number(str(montant1)) + ' €</td></tr>'
-    message += '<tr><td>💿</td><td>Marché identifié comme un marché <strong>logiciel</strong></td></tr>'
-    message += '<tr><td>🧰</td><td>Marché identifié comme un marché de <strong>maintenance</strong></td></tr>'
-    message += '<tr><td>👥</td><td>Marché identifié comme un marché de <strong>prestation de service</strong></td></tr>'
-    message += '<tr><td>🆘</td><td>Marché identifié comme un marché de <strong>d\'assistance</strong></td></tr>'
-    message += '<tr><td>💻</td><td>Marché identifié comme un marché de <strong>matériel</strong></td></tr>'
-    message += '<tr><td>🖨️</td><td>Marché identifié comme un marché de <strong>matériel d\'impression</strong></td></tr>'
-    message += '<tr><td>📞</td><td>Marché identifié comme un marché de <strong>télécommunication</strong></td></tr>'
-    message += '<tr><td>🟢</td><td>Avis de marché</td></tr>'
-    message += '<tr><td>🟠</td><td>Modification d\'un avis de marché</td></tr>'
-    message += '<tr><td>🛑</td><td>Annulation d\'un avis de marché</td></tr>'
-    message += '<tr><td>🏆</td><td>Avis d\'attribution</td></tr></table>'
-    current_date = datetime.now().date()
-    message += '<BR><BR>(C) 2022-' + str(current_date.year) + ' Computacenter - Développé par Julien Mousqueton <BR><BR>Version : ' + __version__
+    message = legend_message(datetime.now().date().year)
 
     if not debug:
         title = 'Légende'
-        # envoi de la légende dans le channel "Attribution"
-        tomsteeams('ATTRIBUTION',title,message)
-        # envoi de la légende dans le channel "Avis de marché"
-        tomsteeams('AVIS',title,message)
+        # envoi de la légende dans tous les channels de la table de routage (par défaut "Attribution" et "Avis de marché")
+        targets = list(dict.fromkeys(target for rule in routes['rules'] for target in rule['targets']))
+        deliver([(datetime.now().strftime("%Y-%m-%d"), title, message, 'AVIS', targets)])
         stdlog('Publication de la légende')
     else:
         print('Légende :\n')
-        print(remove_html_tags(message.replace('</td></tr>','\n').replace('</td><td>','\t').replace('</th></tr>','\n').replace('</th><th>','\t')))
+        print(remove_html_tags(message['html'].replace('</td></tr>','\n').replace('</td><td>','\t').replace('</th></tr>','\n').replace('</th><th>','\t')))
 
 '''
 Main Program  
@@ -976,9 +3158,16 @@ if __name__ == "__main__":
     parser.add_argument("-D", "--debug", action="store_true", help="Active le mode debug (aucun message ne sera envoyé à msteams)")
     parser.add_argument("-n", "--now", action="store_true", help="Force la date du jour au lieu de J-1")
     parser.add_argument("-d", "--date", type=str, help="Spécifie la date du scan au format yyyy-mm-dd", metavar="YYYY-MM-DD")
+    parser.add_argument("--from", dest="date_from", type=str, help="Rattrapage : première date à traiter au format yyyy-mm-dd", metavar="YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", type=str, help="Rattrapage : dernière date à traiter au format yyyy-mm-dd", metavar="YYYY-MM-DD")
     parser.add_argument("-s", "--select", type=str, choices=['attribution', 'ao', 'rectificatif'], help="Selection de la nature de l'avis : 'attribution', 'rectificatif' ou 'ao' (Appel d'Offre)")
-    parser.add_argument("-l", "--legende", action="store_true", help="Publie la légende dans le channel des avis de marché")
-    parser.add_argument("-m", "--motclef", action="store_true", help="Affiche tous les mots clefs")
+    parser.add_argument("-l", "--legende", action="store_true", help="Publie la légende dans tous les channels de la table de routage")
+    parser.add_argument("-m", "--motclef", nargs='?', const='', metavar="PREFIXE", help="Affiche tous les mots clefs (ou ceux dont un mot commence par PREFIXE)")
+    parser.add_argument("-p", "--parallele", action="store_true", help="Récupère les pages de résultats en parallèle")
+    parser.add_argument("--daemon", action="store_true", help="Mode démon : interroge l'API toutes les DAEMON_INTERVALLE minutes")
+    parser.add_argument("--replay", nargs='*', metavar="FICHIER", help="Rejoue sans réseau les snapshots de data/ (ou les fichiers indiqués) vers --sortie")
+    parser.add_argument("--sortie", type=str, default='-', help="Sortie du mode --replay : - (stdout), un fichier ou l'URL d'un stub HTTP local")
+    parser.add_argument("-f", "--force", action="store_true", help="Traite à nouveau les avis déjà envoyés")
     parser.add_argument("-S", "--statistiques", action="store_true", help="Force la création des statistiques quand l'option début est activée")
 
     # Parse arguments
@@ -988,29 +3177,26 @@ if __name__ == "__main__":
     debug_mode=args.debug
     today_mode=args.now
     specified_date = args.date
+    date_from = args.date_from
+    date_to = args.date_to
     select_option = args.select 
     legende = args.legende
     motclef = args.motclef    
     statistiquesdebug = args.statistiques
+    parallel_mode = args.parallele
+    force_mode = args.force
+    daemon_mode = args.daemon
+    replay_files = args.replay
+    replay_sortie = args.sortie
 
     if statistiquesdebug and not debug_mode:
         stdlog("Erreur -S/--statistiques ne peut être utilisé uniquement avec -D/--debug")
         exit(1)
 
-    ### Si option -m ou --motclef 
-    if motclef: 
-        api_url = "https://www.boamp.fr/api/explore/v2.1/catalog/datasets/liste-mots-descripteurs-boamp%2F/records?order_by=mc_libelle&limit=100&timezone=UTC&include_links=false&include_app_metas=false"
-        all_results = fetch_all_keywords(api_url)
-
-        for result in all_results:
-            mc_code = result.get('mc_code', '')
-            mc_libelle = result.get('mc_libelle', '')
-            print(f"{mc_code}, {mc_libelle}")
-        exit()
-
     ### Si mode debug
     if debug_mode:
         stdlog("DEBUG MODE")
+        stdlog("JSON : " + JSON_BACKEND)
 
     # Load the .env file
     load_dotenv()
@@ -1019,8 +3205,8 @@ if __name__ == "__main__":
     ms_webhook_marche = os.getenv('MS_TEAMS_WEBHOOK_MARCHE')
     ms_webhook_attribution = os.getenv('MS_TEAMS_WEBHOOK_ATTRIBUTION')
 
-    mattermost_webhook_marche = os.getenv('MS_TEAMS_WEBHOOK_MARCHE')
-    mattermost_webhook_attribution = os.getenv('MS_TEAMS_WEBHOOK_ATTRIBUTION')
+    mattermost_webhook_marche = os.getenv('MATTERMOST_WEBHOOK_MARCHE')
+    mattermost_webhook_attribution = os.getenv('MATTERMOST_WEBHOOK_ATTRIBUTION')
 
     montant1 = "{:.2f}".format(float(os.getenv('MONTANT1','1000000')))
     montant2 = "{:.2f}".format(float(os.getenv('MONTANT2','2000000')))
@@ -1038,6 +3224,99 @@ if __name__ == "__main__":
     day_before_gzip = int(os.getenv("JOURS_AVANT_GZIP", 0))
     day_before_delete = int(os.getenv("JOURS_AVANT_EFFACEMENT", 0))  
 
+    # Règles de logos (services et tranches de montant), compilées une seule fois
+    logos_file = os.getenv('LOGOS', '')
+    logos_config = None
+    if logos_file:
+        logos_config = load_logos(logos_file)
+        if logos_config is None:
+            toPushover("Règles de logos invalides. Voir " + logos_file)
+            exit(1)
+    logo_classifier = compile_logos(logos_config)
+
+    snapshot_compression = os.getenv("SNAPSHOT_COMPRESSION", '').lower()
+    if snapshot_compression not in SNAPSHOT_EXTENSIONS:
+        stdlog("Erreur SNAPSHOT_COMPRESSION doit valoir gzip, zstd ou être vide")
+        exit(1)
+    if snapshot_compression == 'zstd' and zstandard is None:
+        stdlog("Erreur SNAPSHOT_COMPRESSION=zstd nécessite le module zstandard (pip3 install zstandard)")
+        exit(1)
+    snapshot_niveau = int(os.getenv("SNAPSHOT_NIVEAU", 0))
+
+    pagination_workers = int(os.getenv("PAGINATION_WORKERS", 4))
+
+    backfill_workers = int(os.getenv("BACKFILL_WORKERS", 4))
+    backfill_fenetre = int(os.getenv("BACKFILL_FENETRE", 31))
+
+    livraison_workers = int(os.getenv("LIVRAISON_WORKERS", 4))
+    livraison_concurrence = int(os.getenv("LIVRAISON_CONCURRENCE", 2))
+    livraison_debit = float(os.getenv("LIVRAISON_DEBIT", 2))
+    livraison_essais = max(1, int(os.getenv("LIVRAISON_ESSAIS", 5)))
+    livraison_backoff = float(os.getenv("LIVRAISON_BACKOFF", 1))
+    livraison_renvois_max = int(os.getenv("LIVRAISON_RENVOIS_MAX", 10))
+
+    digest_mode = os.getenv("DIGEST", 'False').lower() not in ('false', '0', '')
+    digest_priorite = os.getenv("DIGEST_PRIORITE", 'True').lower() not in ('false', '0', '')
+    digest_taille_max = int(os.getenv("DIGEST_TAILLE_MAX", 15000))
+
+    parse_workers = int(os.getenv("PARSE_WORKERS", os.cpu_count() or 1))
+    parse_process_seuil = int(os.getenv("PARSE_PROCESS_SEUIL", 200))
+
+    daemon_intervalle = float(os.getenv("DAEMON_INTERVALLE", 15))
+
+    base_avis = os.getenv("BASE_AVIS", 'True').lower() not in ('false', '0', '')
+
+    replay_workers = int(os.getenv("REPLAY_WORKERS", os.cpu_count() or 1))
+
+    metriques = os.getenv("METRIQUES", '')
+
+    motsclefs_ttl = float(os.getenv("MOTSCLEFS_TTL", 168))
+
+    listes_surveillance = os.getenv("LISTES_SURVEILLANCE", '')
+
+    routage = os.getenv("ROUTAGE", '')
+
+    ### Si option -m ou --motclef 
+    if motclef is not None: 
+        catalogue = load_keywords()
+        if catalogue is None:
+            exit(1)
+        if motclef:
+            keywords = search_keywords(catalogue, motclef)
+        else:
+            keywords = sorted(catalogue['labels'].items(), key=lambda item: item[1])
+        for mc_code, mc_libelle in keywords:
+            print(f"{mc_code}, {mc_libelle}")
+        exit()
+
+    ### Si option --replay : aucun appel réseau (ni index, ni base, ni pushover, ni débit limité)
+    if replay_files is not None:
+        debug_mode = False
+        seen_db, seen_index, notice_db = None, None, None
+        USER_KEY = API_KEY = None
+        livraison_debit = 0
+        run_replay(replay_files, replay_workers)
+        exit()
+
+    # Table de routage : fichier ROUTAGE, à défaut les webhooks msteams et/ou mattermost du .env
+    teams_webhooks = (ms_webhook_marche, ms_webhook_attribution)
+    mattermost_webhooks = (mattermost_webhook_marche, mattermost_webhook_attribution)
+    if (any(teams_webhooks) and not all(teams_webhooks)) or (any(mattermost_webhooks) and not all(mattermost_webhooks)) \
+            or not (routage or all(teams_webhooks) or all(mattermost_webhooks)):
+        errmsg = "Erreur: Il manque au moins une webhook pour MsTeams ou Mattermost."
+        stdlog(errmsg)
+        toPushover(errmsg)
+        exit(1)
+    if routage:
+        rules = load_routes(routage)
+        if rules is None:
+            toPushover("Table de routage invalide. Voir " + routage)
+            exit(1)
+        routes = compile_routes(rules)
+        stdlog('Routage : ' + ', '.join(rule['nom'] for rule in routes['rules']))
+    else:
+        routes = compile_routes(default_routes())
+
     ### Si option -l ou --legend 
     if legende: 
         showlegend(debug_mode)
@@ -1053,11 +3332,11 @@ if __name__ == "__main__":
     if debug_mode:
         stdlog('🧹 ' + str(day_before_gzip) + ' jours avant de compresser les fichiers')
         stdlog('🧹 ' + str(day_before_delete) + ' jours avant d\'effacer les fichiers')
-    housekeeping(day_before_gzip, day_before_delete)
+    housekeeping_thread = start_housekeeping(day_before_gzip, day_before_delete)
     
     ## Get Keywords 
     descripteurs_list = os.getenv('DESCRIPTEURS', '').split(',')
-    descripteurs_list = [word.strip() for word in descripteurs_list]
+    descripteurs_list = [word.strip() for word in descripteurs_list if word.strip()]
 
     if not descripteurs_list:
         errmsg = "Aucun code de descripteurs. Voir le fichier .env"
@@ -1065,59 +3344,115 @@ if __name__ == "__main__":
         toPushover(errmsg)
         exit(1)
 
-    if (not ms_webhook_marche or not ms_webhook_attribution) or (not mattermost_webhook_attribution or not mattermost_webhook_marche):
-        errmsg = "Erreur: Il manque au moins une webhook pour MsTeams ou Mattermost."
-        stdlog(errmsg)
-        toPushover(errmsg)
-        exit(1)
+    # Vérification des codes de descripteurs avec le catalogue des mots clefs (en cache)
+    catalogue = load_keywords()
+    if catalogue:
+        unknown = [code for code in descripteurs_list if code not in catalogue['labels']]
+        if unknown:
+            errmsg = "Code(s) de descripteurs inconnu(s) : " + ', '.join(unknown) + ". Voir python3 boamp.py -m"
+            stdlog(errmsg)
+            toPushover(errmsg)
+        stdlog('Descripteurs : ' + ', '.join(code + ' (' + catalogue['labels'][code] + ')' for code in descripteurs_list if code in catalogue['labels']))
+
+    # Listes de surveillance : filtrage local des avis et channels dédiés
+    if listes_surveillance:
+        config = load_watchlists(listes_surveillance)
+        if config is None:
+            errmsg = "Listes de surveillance invalides. Voir " + listes_surveillance
+            toPushover(errmsg)
+            exit(1)
+        watchlists = compile_watchlists(config, descripteurs_list)
+        stdlog('Listes de surveillance : ' + ', '.join(config))
+        if watchlists['regex']:
+            stdlog('(!) Récupération de tous les avis du jour, filtrés localement')
+            # Une fenêtre de rattrapage par jour pour rester sous la limite de 10000 résultats de l'API
+            backfill_fenetre = 1
+
+    # Index des avis déjà traités (non utilisé en mode debug)
+    if debug_mode:
+        seen_db, seen_index = None, None
+    else:
+        seen_db, seen_index = open_seen_index()
+
+    # Base locale des avis pour l'historique (non utilisée en mode debug)
+    notice_db = open_notice_store() if base_avis and not debug_mode else None
+
+    write_stats = (statistiques and not debug_mode) or (statistiquesdebug and debug_mode)
+
+    # Messages non envoyés lors d'une exécution précédente
+    if not debug_mode:
+        drain_dead_letters()
 
-    # Determine the date to process
-    if today_mode:
-        date_to_process = datetime.now().strftime("%Y-%m-%d")
-        stdlog("(!) Date forcée à aujourd'hui : " + date_to_process)
+    ### Si option --daemon
+    if daemon_mode:
+        if date_from or date_to or specified_date or today_mode:
+            stdlog("Erreur --daemon ne peut pas être utilisé avec -n, -d ou --from/--to")
+            exit(1)
+        run_daemon(daemon_intervalle, select_option, parallel_mode)
+        exit()
+
+    # Determine the date(s) to process
+    if date_from or date_to:
+        if not (date_from and date_to):
+            stdlog("Erreur --from et --to doivent être utilisés ensemble")
+            exit(1)
+        if today_mode or specified_date:
+            stdlog("Erreur --from/--to ne peuvent pas être utilisés avec -n/--now ou -d/--date")
+            exit(1)
+        dates_to_process = date_range(date_from, date_to)
+        if not dates_to_process:
+            stdlog("Erreur la date --from doit précéder la date --to")
+            exit(1)
+        stdlog("(!) Rattrapage du " + date_from + " au " + date_to + " (" + str(len(dates_to_process)) + " jours)")
+    elif today_mode:
+        dates_to_process = [datetime.now().strftime("%Y-%m-%d")]
+        stdlog("(!) Date forcée à aujourd'hui : " + dates_to_process[0])
     elif specified_date:
-        date_to_process = specified_date
-        stdlog("(!) Date forcée manuellement : " + date_to_process)
+        dates_to_process = [specified_date]
+        stdlog("(!) Date forcée manuellement : " + specified_date)
     else:
         # Calculate yesterday's date
         yesterday = datetime.now() - timedelta(days=1)
-        date_to_process = yesterday.strftime("%Y-%m-%d")
+        dates_to_process = [yesterday.strftime("%Y-%m-%d")]
 
-    stdlog('Récuperation des données du BOAMP pour le ' + date_to_process)
-    data = fetch_boamp_data(date_to_process, select_option)
-    if data:
-        stdlog('Analyse des données du BOAMP pour le ' + date_to_process)
-        parse_boamp_data(data, date_to_process)
-    else:
-        errmsg='Aucune donnée à analyser'
-        stdlog(errmsg)
-        toPushover(errmsg)
-    
-    ## Ecriture des statistiques dans statistiques.json
-    if (statistiques and not debug_mode) or (statistiquesdebug and debug_mode):
-        file_path = "statistiques.json"
-        # Load existing data from the file
-        try:
-            with open(file_path, "r") as json_file:
-                existing_data = json.load(json_file)
-        except FileNotFoundError:
-            existing_data = {"statistiques": []}
+    if select_option == 'attribution':
+        stdlog('(!) Seulement les attributions')
+    elif select_option == 'ao':
+        stdlog("(!) Seulement les Appels d'Offre")
+    elif select_option == 'rectificatif':
+        stdlog("(!) Seulement les rectificatifs d'appels d'offre")
 
-        existing_dates = [entry["date"] for entry in existing_data["statistiques"]]
-        if date_to_process in existing_dates:
-            stdlog("La date " + date_to_process + " existe déjà. Les statistiques n\'ont pas été mises à jour")
+    if len(dates_to_process) == 1:
+        stdlog('Récuperation des données du BOAMP pour le ' + dates_to_process[0])
+        datas = {dates_to_process[0]: fetch_boamp_data(dates_to_process[0], select_option, parallel_mode)}
+    else:
+        stdlog('Récuperation des données du BOAMP pour ' + str(len(dates_to_process)) + ' jours')
+        datas = fetch_boamp_days(dates_to_process, select_option, parallel_mode)
+
+    stats_entries = []
+    for date_to_process in dates_to_process:
+        data = datas[date_to_process]
+        counters_before = day_counters()
+        if data:
+            stdlog('Analyse des données du BOAMP pour le ' + date_to_process)
+            parse_boamp_data(data, date_to_process)
         else:
-            data = {
-            "date": date_to_process,
-            "Marche": cptao,
-            "Modification": cptmodif,
-            "Notification": cptres,
-            "Autre": cptother
-            }
-            existing_data["statistiques"].append(data)
-
-            with open(file_path, 'w') as json_file:
-                json.dump(existing_data, json_file, indent=4)
-            stdlog('Ecriture des statistiques pour ' + date_to_process)
+            errmsg='Aucune donnée à analyser pour le ' + date_to_process
+            stdlog(errmsg)
+            toPushover(errmsg)
+        counters_after = day_counters()
+        entry = {"date": date_to_process}
+        for key in counters_after:
+            entry[key] = counters_after[key] - counters_before[key]
+        stats_entries.append(entry)
+    
+    ## Ecriture des statistiques dans statistiques.sqlite
+    if write_stats:
+        write_statistiques(stats_entries)
 
+    housekeeping_thread.join()
+    if debug_mode:
+        log_metrics()
+    if metriques:
+        write_metrics(metriques)
     stdlog('Fini !')
\ No newline at end of file
@@ -2,10 +2,13 @@
 # -*- coding: utf-8 -*-
 __author__ = "Julien Mousqueton"
 __email__ = "julien.mousqueton_AT_computacenter.com"
-__version__ = "1.0.0"
+__version__ = "1.1.0"
 
 import pandas as pd
 import logging 
+import sqlite3
+import contextlib
+import urllib.parse
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import warnings
@@ -33,12 +36,16 @@ def errlog(msg):
     logging.error(msg)
 
 def load_data(file_path):
-    # Load data from a JSON file and extract the nested 'statistiques'
-    with open(file_path, 'r') as file:
-        data = pd.read_json(file)
-        df = pd.DataFrame(data['statistiques'].tolist())
-        df['date'] = pd.to_datetime(df['date'])
-        return df
+    # Load the daily statistics written by boamp.py (one row per date), read-only: a missing file is not created
+    try:
+        conn = sqlite3.connect('file:' + urllib.parse.quote(file_path) + '?mode=ro', uri=True)
+    except sqlite3.OperationalError as e:
+        errlog('Impossible d\'ouvrir ' + file_path + ' (' + str(e) + '), lancez d\'abord boamp.py')
+        return None
+    with contextlib.closing(conn):
+        df = pd.read_sql_query("SELECT date, Marche, Modification, Notification, Autre FROM statistiques ORDER BY date", conn)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
 
 def plot_cumulative_bar(df, output_file):
     # Creating a cumulative bar graph
@@ -64,8 +71,8 @@ def plot_cumulative_bar(df, output_file):
     plt.close()
 
 def main():
-    # File path to your 'statistiques.json'
-    file_path = 'statistiques.json'
+    # File path to your 'statistiques.sqlite'
+    file_path = 'statistiques.sqlite'
 
     # File path for the output image
     output_file = 'statistiques.png'
@@ -73,6 +80,8 @@ def main():
     # Load the data
     stdlog('Chargement des données statistiques')
     df = load_data(file_path)
+    if df is None:
+        exit(1)
 
     # Plot the cumulative bar graph and save it as an image
     stdlog("Génération de l'image")